@@ -0,0 +1,75 @@
+"""Benchmark per-turn message persistence against a local PostgREST stand-in.
+
+    uvicorn fake_postgrest:app --port 9001
+    SUPABASE_URL=http://localhost:9001 SUPABASE_KEY=fake.key python bench_persistence.py --turns 200
+
+Compares the old three-round-trip turn (insert user message, select history,
+insert reply) with a single bulk insert and with deferred, batched flushing.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import persistence
+from database import table, execute
+from persistence import MessageWriter, message_row
+
+
+async def three_round_trips(conversation_id):
+    await execute(table("messages").insert(message_row(conversation_id, "user", "question")))
+    await execute(table("messages").select("*").eq("conversation_id", conversation_id))
+    await execute(table("messages").insert(message_row(conversation_id, "assistant", "answer")))
+
+
+async def measure(name, turn, turns, concurrency, writer=None):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(i):
+        async with semaphore:
+            start = time.perf_counter()
+            await turn(i % 50 + 1)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(turns)))
+    request_path = time.perf_counter() - start
+    if writer:
+        await writer.stop()
+    total = time.perf_counter() - start
+
+    latencies.sort()
+    print(f"{name:<20} p50 {statistics.median(latencies) * 1000:7.1f} ms"
+          f"   p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:7.1f} ms"
+          f"   request path {request_path:6.2f} s   until durable {total:6.2f} s")
+
+
+async def run(turns, concurrency):
+    await measure("three round trips", three_round_trips, turns, concurrency)
+
+    persistence.MESSAGE_WRITE_MODE = "sync"
+    writer = MessageWriter()
+    await measure(
+        "bulk insert",
+        lambda cid: writer.write([message_row(cid, "user", "question"), message_row(cid, "assistant", "answer")]),
+        turns, concurrency
+    )
+
+    persistence.MESSAGE_WRITE_MODE = "deferred"
+    writer = MessageWriter()
+    await writer.start()
+    await measure(
+        "deferred flush",
+        lambda cid: writer.write([message_row(cid, "user", "question"), message_row(cid, "assistant", "answer")]),
+        turns, concurrency, writer
+    )
+    print(f"deferred flush wrote {writer.flushed_rows} rows in {writer.flushed_batches} inserts")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--turns", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=10)
+    args = parser.parse_args()
+    asyncio.run(run(args.turns, args.concurrency))
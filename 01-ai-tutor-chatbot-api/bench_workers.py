@@ -0,0 +1,101 @@
+"""Measure requests/sec of the tutor API as the gunicorn worker count grows.
+
+Start the stand-ins first (see README), with no artificial token delay so the
+API itself is the bottleneck:
+
+    FAKE_OPENAI_TOKEN_DELAY=0 uvicorn fake_openai:app --port 9000 --workers 4
+    FAKE_POSTGREST_LATENCY=0 uvicorn fake_postgrest:app --port 9001
+    python bench_workers.py --workers 1 2 4
+
+Each run starts `gunicorn main:app -c gunicorn.conf.py` with WEB_CONCURRENCY
+set to the worker count, drives it with concurrent tutor turns for a fixed
+duration, then shuts it down gracefully.
+"""
+import argparse
+import asyncio
+import os
+import signal
+import subprocess
+import time
+
+import httpx
+
+PORT = 8100
+
+
+async def wait_ready(base_url, timeout=30):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get("/")).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError("server did not start")
+
+
+async def drive(base_url, concurrency, duration):
+    completed = 0
+    errors = 0
+    deadline = time.monotonic() + duration
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        conversation_ids = [
+            (await client.post("/conversations")).json()["id"] for _ in range(concurrency)
+        ]
+
+        async def student(conversation_id):
+            nonlocal completed, errors
+            while time.monotonic() < deadline:
+                response = await client.post(
+                    f"/conversations/{conversation_id}/messages",
+                    json={"message": "What is the derivative of x squared?", "cache": False}
+                )
+                if response.status_code == 200:
+                    completed += 1
+                else:
+                    errors += 1
+
+        start = time.monotonic()
+        await asyncio.gather(*(student(cid) for cid in conversation_ids))
+        elapsed = time.monotonic() - start
+    return completed / elapsed, errors
+
+
+def run(worker_counts, concurrency, duration):
+    base_url = f"http://127.0.0.1:{PORT}"
+    env = {
+        **os.environ,
+        "PORT": str(PORT),
+        "OPENAI_BASE_URL": os.getenv("OPENAI_BASE_URL", "http://localhost:9000/v1"),
+        "OPENAI_API_KEY": os.getenv("OPENAI_API_KEY", "fake"),
+        "SUPABASE_URL": os.getenv("SUPABASE_URL", "http://localhost:9001"),
+        "SUPABASE_KEY": os.getenv("SUPABASE_KEY", "fake.key"),
+    }
+    baseline = None
+    for workers in worker_counts:
+        server = subprocess.Popen(
+            ["gunicorn", "main:app", "-c", "gunicorn.conf.py", "--access-logfile", "/dev/null"],
+            env={**env, "WEB_CONCURRENCY": str(workers)},
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL
+        )
+        try:
+            asyncio.run(wait_ready(base_url))
+            rps, errors = asyncio.run(drive(base_url, concurrency, duration))
+        finally:
+            server.send_signal(signal.SIGTERM)
+            server.wait(timeout=60)
+        baseline = baseline or rps
+        print(f"{workers:>2} workers: {rps:8.1f} req/s  ({rps / baseline:4.2f}x)  errors {errors}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=10)
+    args = parser.parse_args()
+    run(args.workers, args.concurrency, args.duration)
@@ -0,0 +1,75 @@
+"""Shared fixtures: the API running against fake_openai and fake_postgrest.
+
+The stand-ins and the API are started once per test session as subprocesses on
+free ports.
+"""
+import os
+import socket
+import subprocess
+import sys
+import time
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+# The canned reply is 14 tokens, so one completion takes about 0.4s
+TOKEN_DELAY = 0.03
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_ready(url, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{url} exited with {process.returncode}")
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    raise RuntimeError(f"{url} did not start")
+
+
+@pytest.fixture(scope="session")
+def stack():
+    here = os.path.dirname(os.path.abspath(__file__))
+    openai_port, postgrest_port, api_port = free_port(), free_port(), free_port()
+    env = {
+        **os.environ,
+        "FAKE_OPENAI_TOKEN_DELAY": str(TOKEN_DELAY),
+        "FAKE_POSTGREST_LATENCY": "0.01",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{openai_port}/v1",
+        "OPENAI_API_KEY": "fake",
+        "SUPABASE_URL": f"http://127.0.0.1:{postgrest_port}",
+        "SUPABASE_KEY": "fake.key",
+        "TITLE_JOBS_ENABLED": "false",
+    }
+    servers = []
+    try:
+        for module, port, ready_path in (
+            ("fake_openai:app", openai_port, "/v1/models"),
+            ("fake_postgrest:app", postgrest_port, "/"),
+            ("main:app", api_port, "/"),
+        ):
+            process = subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", module, "--port", str(port), "--log-level", "warning"],
+                cwd=here, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+            )
+            servers.append(process)
+            wait_ready(f"http://127.0.0.1:{port}{ready_path}", process)
+        yield SimpleNamespace(
+            api=f"http://127.0.0.1:{api_port}",
+            postgrest=f"http://127.0.0.1:{postgrest_port}",
+            token_delay=TOKEN_DELAY
+        )
+    finally:
+        for process in servers:
+            process.terminate()
+        for process in servers:
+            process.wait(timeout=10)
@@ -0,0 +1,108 @@
+from collections import OrderedDict
+import os
+
+try:
+    import tiktoken
+    _encoding = tiktoken.encoding_for_model("gpt-3.5-turbo")
+except Exception:
+    # tiktoken missing or its BPE file unavailable: fall back to a length estimate
+    _encoding = None
+
+MODEL = "gpt-3.5-turbo"
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", "300"))
+SUMMARY_CACHE_SIZE = int(os.getenv("SUMMARY_CACHE_SIZE", "1000"))
+
+# Per-message framing tokens used by the chat format, plus the reply primer
+_TOKENS_PER_MESSAGE = 4
+_TOKENS_PER_REPLY = 2
+
+# conversation_id -> (number of leading messages folded into the summary, summary text)
+_summaries = OrderedDict()
+
+
+def count_text_tokens(text):
+    if _encoding is None:
+        return len(text) // 4 + 1
+    return len(_encoding.encode(text))
+
+
+def count_message_tokens(message):
+    return _TOKENS_PER_MESSAGE + count_text_tokens(message["content"])
+
+
+def count_tokens(messages):
+    return sum(count_message_tokens(m) for m in messages) + _TOKENS_PER_REPLY
+
+
+def _summary_message(summary):
+    return {"role": "system", "content": f"Summary of the earlier conversation: {summary}"}
+
+
+async def _summarize(llm, conversation_id, previous_summary, messages):
+    transcript = "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+    if previous_summary:
+        transcript = f"Previous summary: {previous_summary}\n\n{transcript}"
+    response = await llm.create(
+        conversation_id,
+        model=MODEL,
+        max_tokens=SUMMARY_MAX_TOKENS,
+        messages=[
+            {"role": "system", "content": (
+                "You summarize tutoring conversations. Keep the student's goals, the topics covered, "
+                "what they struggled with and any facts they will need later. Be concise."
+            )},
+            {"role": "user", "content": transcript}
+        ]
+    )
+    return response.choices[0].message.content.strip()
+
+
+async def build_context(llm, conversation_id, history, budget=CONTEXT_TOKEN_BUDGET):
+    """Assemble the prompt for a turn within a token budget.
+
+    The most recent messages are kept verbatim. Once they no longer fit, older
+    messages are folded into a rolling summary that is cached per conversation.
+    The boundary is moved far enough to leave half the budget free, so a new
+    summary is only needed every few turns rather than on each one. Summaries
+    are requested through `llm`, the LLM gateway.
+
+    Returns (messages, stats) where stats reports the prompt-token savings.
+    """
+    message_tokens = [count_message_tokens(m) for m in history]
+    full_tokens = sum(message_tokens) + _TOKENS_PER_REPLY
+
+    boundary, summary = _summaries.get(conversation_id, (0, None))
+    if boundary > len(history):
+        # History was truncated or reloaded differently; start over
+        boundary, summary = 0, None
+    summary_tokens = count_message_tokens(_summary_message(summary)) if summary else 0
+
+    recent_tokens = sum(message_tokens[boundary:]) + _TOKENS_PER_REPLY
+    if summary_tokens + recent_tokens > budget:
+        # Always keep at least the latest message verbatim
+        target = budget // 2
+        new_boundary = boundary
+        while new_boundary < len(history) - 1 and recent_tokens > target:
+            recent_tokens -= message_tokens[new_boundary]
+            new_boundary += 1
+        summary = await _summarize(llm, conversation_id, summary, history[boundary:new_boundary])
+        boundary = new_boundary
+
+    if summary:
+        _summaries[conversation_id] = (boundary, summary)
+        _summaries.move_to_end(conversation_id)
+        while len(_summaries) > SUMMARY_CACHE_SIZE:
+            _summaries.popitem(last=False)
+        messages = [_summary_message(summary)] + history[boundary:]
+    else:
+        messages = list(history)
+
+    prompt_tokens = count_tokens(messages)
+    stats = {
+        "prompt_tokens": prompt_tokens,
+        "full_history_tokens": full_tokens,
+        "prompt_tokens_saved": max(full_tokens - prompt_tokens, 0),
+        "summarized_messages": boundary
+    }
+    return messages, stats
@@ -1,13 +1,49 @@
 from supabase import create_client, Client
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
 import os
 from dotenv import load_dotenv
 
 load_dotenv()
 
-supabase: Client = create_client(
-    os.getenv("SUPABASE_URL"),
-    os.getenv("SUPABASE_KEY")
-)
+# Created per process by connect(), normally from the app lifespan, so forked
+# workers never share sockets or threads with the parent.
+supabase: Client = None
+_executor: ThreadPoolExecutor = None
+
+def connect():
+    """Create this process's Supabase client and query thread pool."""
+    global supabase, _executor
+    supabase = create_client(
+        os.getenv("SUPABASE_URL"),
+        os.getenv("SUPABASE_KEY")
+    )
+    # The Supabase client is synchronous, so queries run on a bounded pool of worker
+    # threads instead of blocking the event loop. The client's HTTP session is shared.
+    _executor = ThreadPoolExecutor(
+        max_workers=int(os.getenv("SUPABASE_MAX_WORKERS", "16")),
+        thread_name_prefix="supabase"
+    )
+
+def close():
+    """Wait for in-flight queries, then release the thread pool and HTTP session."""
+    global supabase, _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+    if supabase is not None:
+        supabase.postgrest.aclose()
+        supabase = None
+
+def table(name: str):
+    if supabase is None:
+        connect()
+    return supabase.table(name)
+
+async def execute(query):
+    """Run a Supabase query builder's execute() without blocking the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, query.execute)
 
 def init_db():
     Base.metadata.create_all(bind=engine)
@@ -17,4 +53,4 @@ def get_db():
     try:
         yield db
     finally:
-        db.close() 
\ No newline at end of file
+        db.close() 
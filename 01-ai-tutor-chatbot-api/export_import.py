@@ -0,0 +1,191 @@
+import json
+import os
+import zlib
+
+from fastapi import HTTPException, Request
+from fastapi.responses import StreamingResponse
+
+from database import table, execute
+from pagination import encode_cursor, keyset_page
+
+# Conversations per export batch; each batch's messages are read with a single
+# `conversation_id in (...)` filter instead of one query per conversation
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "500"))
+# Messages per read, kept at or below the PostgREST max-rows setting
+EXPORT_MESSAGE_PAGE_SIZE = int(os.getenv("EXPORT_MESSAGE_PAGE_SIZE", "1000"))
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "500"))
+
+
+async def export_records(cursor=None):
+    """Yield conversation and message records in batches, each followed by a cursor record.
+
+    Memory is bounded by one batch of conversations plus one page of messages.
+    """
+    while True:
+        page = await execute(keyset_page(table("conversations").select("*"), cursor, EXPORT_BATCH_SIZE))
+        conversations = page.data[:EXPORT_BATCH_SIZE]
+        if not conversations:
+            return
+        for conversation in conversations:
+            yield {"type": "conversation", **conversation}
+
+        ids = [conversation["id"] for conversation in conversations]
+        last_id = 0
+        while True:
+            query = table("messages").select("*").in_("conversation_id", ids)
+            if last_id:
+                query = query.gt("id", last_id)
+            messages = (await execute(query.order("id").limit(EXPORT_MESSAGE_PAGE_SIZE))).data
+            for message in messages:
+                yield {"type": "message", **message}
+            if len(messages) < EXPORT_MESSAGE_PAGE_SIZE:
+                break
+            last_id = messages[-1]["id"]
+
+        # Everything up to here is complete; an interrupted export resumes from this cursor
+        cursor = encode_cursor(conversations[-1])
+        yield {"type": "cursor", "cursor": cursor}
+        if len(page.data) <= EXPORT_BATCH_SIZE:
+            return
+
+
+def export_response(cursor=None, gzip=False):
+    async def body():
+        compressor = zlib.compressobj(wbits=31) if gzip else None
+        try:
+            async for record in export_records(cursor):
+                line = (json.dumps(record) + "\n").encode()
+                if compressor is None:
+                    yield line
+                    continue
+                yield compressor.compress(line)
+                if record["type"] == "cursor":
+                    # Push each finished batch to the client instead of holding it in zlib
+                    yield compressor.flush(zlib.Z_SYNC_FLUSH)
+        except Exception as e:
+            # Headers are already sent, so report the failure in-band
+            line = (json.dumps({"type": "error", "detail": str(e)}) + "\n").encode()
+            yield compressor.compress(line) if compressor else line
+        if compressor is not None:
+            yield compressor.flush()
+
+    headers = {"Content-Encoding": "gzip"} if gzip else {}
+    return StreamingResponse(body(), media_type="application/x-ndjson", headers=headers)
+
+
+async def _lines(request: Request):
+    """Split a (possibly gzipped) request body into lines without buffering all of it."""
+    decompressor = None
+    if request.headers.get("content-encoding", "").lower() == "gzip":
+        decompressor = zlib.decompressobj(wbits=31)
+    buffer = b""
+    async for chunk in request.stream():
+        buffer += decompressor.decompress(chunk) if decompressor else chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield line
+    if decompressor:
+        buffer += decompressor.flush()
+    if buffer.strip():
+        yield buffer
+
+
+class Importer:
+    """Writes exported records back in bulk, remapping conversation ids.
+
+    Rows are committed batch by batch. If the import fails, the rows written
+    since the last cursor record are deleted, so re-running the export from the
+    returned cursor and importing that does not duplicate anything.
+    """
+
+    def __init__(self):
+        self.conversations = []
+        self.messages = []
+        # Old conversation id -> new id, for the batch since the last cursor
+        self.id_map = {}
+        self.cursor = None
+        self.imported_conversations = 0
+        self.imported_messages = 0
+
+    async def add(self, record):
+        kind = record.pop("type", None)
+        if kind == "conversation":
+            self.conversations.append(record)
+            if len(self.conversations) >= IMPORT_BATCH_SIZE:
+                await self.flush_conversations()
+        elif kind == "message":
+            # Messages reference conversations, so those are written first
+            await self.flush_conversations()
+            old_id = record.get("conversation_id")
+            if old_id not in self.id_map:
+                raise HTTPException(status_code=400, detail=f"Message references unknown conversation {old_id}")
+            record.pop("id", None)
+            record["conversation_id"] = self.id_map[old_id]
+            self.messages.append(record)
+            if len(self.messages) >= IMPORT_BATCH_SIZE:
+                await self.flush_messages()
+        elif kind == "cursor":
+            await self.flush()
+            self.cursor = record["cursor"]
+            self.id_map = {}
+        else:
+            raise HTTPException(status_code=400, detail=f"Unknown record type: {kind}")
+
+    async def flush_conversations(self):
+        if not self.conversations:
+            return
+        old_ids = [row.pop("id", None) for row in self.conversations]
+        result = await execute(table("conversations").insert(self.conversations))
+        for old_id, row in zip(old_ids, result.data):
+            self.id_map[old_id] = row["id"]
+        self.imported_conversations += len(result.data)
+        self.conversations = []
+
+    async def flush_messages(self):
+        if not self.messages:
+            return
+        result = await execute(table("messages").insert(self.messages))
+        self.imported_messages += len(result.data)
+        self.messages = []
+
+    async def flush(self):
+        await self.flush_conversations()
+        await self.flush_messages()
+
+    async def rollback(self):
+        """Delete what was written after the last cursor record."""
+        new_ids = list(self.id_map.values())
+        if not new_ids:
+            return
+        await execute(table("messages").delete().in_("conversation_id", new_ids))
+        await execute(table("conversations").delete().in_("id", new_ids))
+
+    def summary(self):
+        return {
+            "conversations": self.imported_conversations,
+            "messages": self.imported_messages,
+            "cursor": self.cursor
+        }
+
+
+async def import_records(request: Request):
+    importer = Importer()
+    try:
+        async for line in _lines(request):
+            try:
+                record = json.loads(line)
+            except ValueError:
+                raise HTTPException(status_code=400, detail="Invalid NDJSON line")
+            await importer.add(record)
+        await importer.flush()
+    except Exception as e:
+        try:
+            await importer.rollback()
+        except Exception as rollback_error:
+            print(f"Import rollback failed: {rollback_error}")
+        status = e.status_code if isinstance(e, HTTPException) else 500
+        detail = e.detail if isinstance(e, HTTPException) else str(e)
+        # The cursor tells the client where to resume the export from
+        raise HTTPException(status_code=status, detail={"error": detail, "resume_cursor": importer.cursor})
+    return importer.summary()
@@ -0,0 +1,104 @@
+"""Minimal stand-in for the OpenAI chat completions API, for local testing.
+
+Run it with `uvicorn fake_openai:app --port 9000` and start the tutor API with
+`OPENAI_BASE_URL=http://localhost:9000/v1`. Replies are canned and paced by
+FAKE_OPENAI_TOKEN_DELAY so streaming and latency behaviour can be observed.
+Set FAKE_OPENAI_MAX_CONCURRENCY to answer 429 to completions beyond that many
+in flight, like a rate-limited account.
+"""
+import asyncio
+import json
+import os
+import time
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+app = FastAPI()
+
+TOKEN_DELAY = float(os.getenv("FAKE_OPENAI_TOKEN_DELAY", "0.05"))
+REPLY = os.getenv(
+    "FAKE_OPENAI_REPLY",
+    "Great question! Let's work through it step by step so the idea really sticks."
+)
+# 0 means unlimited
+MAX_CONCURRENCY = int(os.getenv("FAKE_OPENAI_MAX_CONCURRENCY", "0"))
+
+in_flight = 0
+
+
+def _tokens():
+    words = REPLY.split(" ")
+    return [word if i == 0 else " " + word for i, word in enumerate(words)]
+
+
+@app.get("/v1/models")
+async def list_models():
+    return {"object": "list", "data": [{"id": "gpt-3.5-turbo", "object": "model", "created": 0, "owned_by": "fake"}]}
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    global in_flight
+    if MAX_CONCURRENCY and in_flight >= MAX_CONCURRENCY:
+        return JSONResponse(
+            status_code=429,
+            content={"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}},
+            headers={"retry-after": "1"}
+        )
+    body = await request.json()
+    model = body.get("model", "gpt-3.5-turbo")
+    completion_id = f"chatcmpl-fake-{int(time.time() * 1000)}"
+    tokens = _tokens()
+
+    in_flight += 1
+    if not body.get("stream"):
+        # Simulate whole-completion latency
+        try:
+            await asyncio.sleep(TOKEN_DELAY * len(tokens))
+        finally:
+            in_flight -= 1
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": REPLY},
+                "finish_reason": "stop"
+            }],
+            "usage": {"prompt_tokens": 0, "completion_tokens": len(tokens), "total_tokens": len(tokens)}
+        }
+
+    async def event_stream():
+        global in_flight
+        try:
+            async for event in _events(completion_id, model, tokens):
+                yield event
+        finally:
+            in_flight -= 1
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+
+async def _events(completion_id, model, tokens):
+    for token in tokens:
+        await asyncio.sleep(TOKEN_DELAY)
+        chunk = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]
+        }
+        yield f"data: {json.dumps(chunk)}\n\n"
+    done = {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]
+    }
+    yield f"data: {json.dumps(done)}\n\n"
+    yield "data: [DONE]\n\n"
@@ -0,0 +1,152 @@
+"""In-memory stand-in for the Supabase PostgREST endpoint, for local benchmarks.
+
+Run it with `uvicorn fake_postgrest:app --port 9001` and start the tutor API with
+`SUPABASE_URL=http://localhost:9001 SUPABASE_KEY=fake.key`. Every request waits
+FAKE_POSTGREST_LATENCY seconds to model the network round trip to Supabase.
+Supports inserts, upserts, updates, deletes and selects with eq/gt/lt/in
+filters, or/and trees, order and limit.
+"""
+import asyncio
+import itertools
+import os
+
+from fastapi import FastAPI, Request
+
+app = FastAPI()
+
+LATENCY = float(os.getenv("FAKE_POSTGREST_LATENCY", "0.02"))
+
+tables = {}
+_ids = {}
+stats = {"requests": 0, "rows_written": 0, "rows_read": 0}
+
+
+def _coerce(value):
+    try:
+        return int(value)
+    except ValueError:
+        return value.strip('"')
+
+
+def _split(terms):
+    """Split a logic tree's terms on commas outside parentheses and quotes."""
+    parts, depth, quoted, start = [], 0, False, 0
+    for i, char in enumerate(terms):
+        if char == '"':
+            quoted = not quoted
+        elif not quoted and char == "(":
+            depth += 1
+        elif not quoted and char == ")":
+            depth -= 1
+        elif not quoted and char == "," and depth == 0:
+            parts.append(terms[start:i])
+            start = i + 1
+    parts.append(terms[start:])
+    return parts
+
+
+def _matches_tree(row, operator, terms):
+    results = []
+    for term in _split(terms[1:-1]):
+        if term.startswith(("and(", "or(")):
+            op, _, rest = term.partition("(")
+            results.append(_matches_tree(row, op, "(" + rest))
+        else:
+            column, _, expression = term.partition(".")
+            results.append(_matches(row, column, expression))
+    return all(results) if operator == "and" else any(results)
+
+
+def _matches(row, column, expression):
+    op, _, value = expression.partition(".")
+    if op == "in":
+        return row.get(column) in {_coerce(v) for v in _split(value[1:-1])}
+    value = _coerce(value)
+    if op == "eq":
+        return row.get(column) == value
+    if op == "gt":
+        return row.get(column) is not None and row.get(column) > value
+    if op == "lt":
+        return row.get(column) is not None and row.get(column) < value
+    return True
+
+
+def _filter(rows, params):
+    for column, expression in params.multi_items():
+        if column in ("select", "order", "limit", "offset"):
+            continue
+        if column in ("or", "and"):
+            rows = [row for row in rows if _matches_tree(row, column, expression)]
+        else:
+            rows = [row for row in rows if _matches(row, column, expression)]
+    return rows
+
+
+@app.post("/rest/v1/{table}")
+async def insert(table: str, request: Request):
+    await asyncio.sleep(LATENCY)
+    stats["requests"] += 1
+    payload = await request.json()
+    rows = payload if isinstance(payload, list) else [payload]
+    counter = _ids.setdefault(table, itertools.count(1))
+    conflict = request.query_params.get("on_conflict", "id")
+    merge = "merge-duplicates" in request.headers.get("prefer", "")
+    inserted = []
+    for row in rows:
+        existing = [r for r in tables.get(table, []) if conflict in row and r.get(conflict) == row[conflict]]
+        if merge and existing:
+            existing[0].update(row)
+            inserted.append(existing[0])
+            continue
+        row = {"id": next(counter), **row}
+        tables.setdefault(table, []).append(row)
+        inserted.append(row)
+    stats["rows_written"] += len(inserted)
+    return inserted
+
+
+@app.get("/rest/v1/{table}")
+async def select(table: str, request: Request):
+    await asyncio.sleep(LATENCY)
+    stats["requests"] += 1
+    params = request.query_params
+    rows = _filter(tables.get(table, []), params)
+    if "order" in params:
+        for term in reversed(params["order"].split(",")):
+            column, _, direction = term.partition(".")
+            rows = sorted(rows, key=lambda r: r.get(column), reverse=direction.startswith("desc"))
+    if "limit" in params:
+        rows = rows[:int(params["limit"])]
+    columns = params.get("select", "*")
+    if columns != "*":
+        names = [c.strip() for c in columns.split(",")]
+        rows = [{name: row.get(name) for name in names} for row in rows]
+    stats["rows_read"] += len(rows)
+    return rows
+
+
+@app.patch("/rest/v1/{table}")
+async def update(table: str, request: Request):
+    await asyncio.sleep(LATENCY)
+    stats["requests"] += 1
+    values = await request.json()
+    updated = _filter(tables.get(table, []), request.query_params)
+    for row in updated:
+        row.update(values)
+    stats["rows_written"] += len(updated)
+    return updated
+
+
+@app.delete("/rest/v1/{table}")
+async def delete(table: str, request: Request):
+    await asyncio.sleep(LATENCY)
+    stats["requests"] += 1
+    deleted = _filter(tables.get(table, []), request.query_params)
+    ids = {id(row) for row in deleted}
+    tables[table] = [row for row in tables.get(table, []) if id(row) not in ids]
+    return deleted
+
+
+@app.get("/stats")
+async def get_stats():
+    return stats
@@ -0,0 +1,22 @@
+# Production server profile: gunicorn supervising uvicorn workers.
+# Start with `gunicorn main:app -c gunicorn.conf.py`.
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '10000')}"
+worker_class = "uvicorn.workers.UvicornWorker"
+# The API is I/O bound and async, so one worker per core is enough
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+
+# Completions can take a while; only kill workers that are truly stuck
+timeout = int(os.getenv("WORKER_TIMEOUT", "120"))
+# On SIGTERM, workers stop accepting connections, finish in-flight requests and
+# run the lifespan shutdown (flushing queued message writes) within this window
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+keepalive = 5
+
+# Recycle workers now and then to bound memory growth of the in-process caches
+max_requests = int(os.getenv("MAX_REQUESTS", "10000"))
+max_requests_jitter = 1000
+
+accesslog = "-"
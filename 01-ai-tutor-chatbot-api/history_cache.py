@@ -0,0 +1,122 @@
+from collections import OrderedDict
+import os
+import time
+
+# Rough per-message bookkeeping overhead on top of the content bytes
+_MESSAGE_OVERHEAD = 64
+
+
+class _Entry:
+    __slots__ = ("messages", "ids", "size", "expires_at", "synced_id")
+
+    def __init__(self, ttl):
+        self.messages = []
+        self.ids = set()
+        self.size = 0
+        self.expires_at = time.monotonic() + ttl
+        # Highest id read back from Supabase. Rows this worker wrote don't move
+        # it: another worker's rows may sit below them and not be read yet.
+        self.synced_id = 0
+
+
+class HistoryCache:
+    """Write-through, per-conversation message history cache.
+
+    Entries are evicted least-recently-used once the total size passes
+    `max_bytes`, and expire `ttl` seconds after they were loaded from Supabase.
+    """
+
+    def __init__(self, max_bytes, ttl):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, conversation_id):
+        """Return the cached entry for a conversation, or None on a miss."""
+        entry = self._entries.get(conversation_id)
+        if entry is not None and entry.expires_at <= time.monotonic():
+            self.expirations += 1
+            self.invalidate(conversation_id)
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(conversation_id)
+        return entry
+
+    def put(self, conversation_id, rows):
+        """Replace a conversation's history with rows freshly loaded from Supabase."""
+        self.invalidate(conversation_id)
+        entry = _Entry(self.ttl)
+        self._entries[conversation_id] = entry
+        self.extend(conversation_id, rows, synced=True)
+
+    def extend(self, conversation_id, rows, synced=False):
+        """Merge new message rows into a cached conversation, skipping ones already present.
+
+        `synced` marks rows read from Supabase, which advance the entry's
+        `synced_id`; rows written by this worker are merged but don't.
+        """
+        entry = self._entries.get(conversation_id)
+        if entry is None:
+            return
+        if synced and rows:
+            entry.synced_id = max(entry.synced_id, max(row["id"] for row in rows))
+        tail = entry.messages[-1]["id"] if entry.messages else 0
+        out_of_order = False
+        for row in rows:
+            if row["id"] in entry.ids:
+                continue
+            out_of_order = out_of_order or row["id"] < tail
+            message = {"id": row["id"], "role": row["role"], "content": row["content"]}
+            entry.messages.append(message)
+            entry.ids.add(row["id"])
+            size = len(row["content"].encode()) + _MESSAGE_OVERHEAD
+            entry.size += size
+            self._size += size
+        # Concurrent turns, or other workers' rows read after our own, can land out of order
+        if out_of_order:
+            entry.messages.sort(key=lambda m: m["id"])
+        self._evict()
+
+    def invalidate(self, conversation_id):
+        entry = self._entries.pop(conversation_id, None)
+        if entry is not None:
+            self._size -= entry.size
+
+    def history(self, conversation_id):
+        entry = self._entries.get(conversation_id)
+        if entry is None:
+            return None
+        return [{"role": m["role"], "content": m["content"]} for m in entry.messages]
+
+    def _evict(self):
+        while self._size > self.max_bytes and self._entries:
+            _, entry = self._entries.popitem(last=False)
+            self._size -= entry.size
+            self.evictions += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "conversations": len(self._entries),
+            "bytes": self._size,
+            "max_bytes": self.max_bytes
+        }
+
+
+history_cache = HistoryCache(
+    max_bytes=int(os.getenv("HISTORY_CACHE_MAX_BYTES", str(32 * 1024 * 1024))),
+    ttl=float(os.getenv("HISTORY_CACHE_TTL", "300"))
+)
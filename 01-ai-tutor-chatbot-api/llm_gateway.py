@@ -0,0 +1,254 @@
+from collections import OrderedDict, deque
+import asyncio
+import os
+import random
+import time
+
+import openai
+
+from context_window import count_text_tokens, count_tokens
+from metrics import registry, span
+
+# All limits are per worker process; divide account-wide limits by WEB_CONCURRENCY
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+# 0 disables the token budget
+LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", "60000"))
+# Reserved for the reply when a call does not set max_tokens; reconciled with actual usage
+LLM_COMPLETION_TOKEN_ESTIMATE = int(os.getenv("LLM_COMPLETION_TOKEN_ESTIMATE", "500"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+# How long a call may wait for a slot before it is rejected with a 503
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "120"))
+LLM_MAX_BACKOFF = 20.0
+
+_RETRYABLE = (
+    openai.RateLimitError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
+
+class LLMUnavailable(Exception):
+    """The LLM could not be reached in time; the client should retry later."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class LLMGateway:
+    """Shared admission control for every OpenAI call made by this worker.
+
+    Calls wait for a concurrency slot and for enough room in a tokens-per-minute
+    bucket. Waiting calls are queued per conversation and served round-robin,
+    so one busy conversation cannot starve the others.
+
+    Rate limits and transient errors are retried with jittered exponential
+    backoff. A 429 also pauses dispatching until its Retry-After has passed and
+    halves the concurrency limit, which then grows back by one slot per limit's
+    worth of successful calls (AIMD). A burst therefore turns into queueing
+    delay rather than failed requests, even when `max_concurrency` is set
+    higher than the account allows.
+    """
+
+    def __init__(self, max_concurrency, tokens_per_minute, max_retries, queue_timeout):
+        self.client = None
+        self.max_concurrency = max_concurrency
+        self.tokens_per_minute = tokens_per_minute
+        self.max_retries = max_retries
+        self.queue_timeout = queue_timeout
+        # conversation_id -> deque of (future, reserved tokens), in round-robin order
+        self._waiting = OrderedDict()
+        self._queued = 0
+        self._active = 0
+        self._limit = float(max_concurrency)
+        self._tokens = float(tokens_per_minute)
+        self._refilled_at = time.monotonic()
+        self._paused_until = 0.0
+        self._wakeup = None
+        self.retries = 0
+        self.rate_limited = 0
+        self.rejected = 0
+
+    def bind(self, client):
+        self.client = client
+
+    def _refill(self, now):
+        if self.tokens_per_minute:
+            elapsed = now - self._refilled_at
+            self._tokens = min(self.tokens_per_minute, self._tokens + elapsed * self.tokens_per_minute / 60)
+        self._refilled_at = now
+
+    def _schedule(self, delay):
+        if self._wakeup is not None:
+            self._wakeup.cancel()
+        self._wakeup = asyncio.get_running_loop().call_later(delay, self._dispatch)
+
+    def _dispatch(self):
+        self._wakeup = None
+        now = time.monotonic()
+        self._refill(now)
+        while self._waiting and self._active < int(self._limit):
+            if now < self._paused_until:
+                self._schedule(self._paused_until - now)
+                return
+            conversation_id, waiters = next(iter(self._waiting.items()))
+            future, tokens = waiters[0]
+            if not future.done():
+                # A call larger than the whole budget only waits for a full bucket
+                needed = min(tokens, self.tokens_per_minute)
+                if self.tokens_per_minute and self._tokens < needed:
+                    self._schedule((needed - self._tokens) * 60 / self.tokens_per_minute)
+                    return
+                self._tokens -= tokens
+                self._active += 1
+                future.set_result(None)
+            waiters.popleft()
+            self._queued -= 1
+            if waiters:
+                self._waiting.move_to_end(conversation_id)
+            else:
+                del self._waiting[conversation_id]
+
+    async def _acquire(self, conversation_id, tokens):
+        future = asyncio.get_running_loop().create_future()
+        self._waiting.setdefault(conversation_id, deque()).append((future, tokens))
+        self._queued += 1
+        self._dispatch()
+        try:
+            await asyncio.wait_for(future, self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            self._withdraw(conversation_id, future)
+            raise LLMUnavailable("LLM queue is full, try again shortly", retry_after=5)
+        except asyncio.CancelledError:
+            # The slot may have been granted just as the caller went away
+            if future.done() and not future.cancelled():
+                self._release(tokens, 0)
+            else:
+                self._withdraw(conversation_id, future)
+            raise
+
+    def _withdraw(self, conversation_id, future):
+        """Remove a waiter that gave up, so it stops counting towards the queue depth."""
+        waiters = self._waiting.get(conversation_id)
+        if waiters is None:
+            return
+        for i, (waiting, _) in enumerate(waiters):
+            if waiting is future:
+                del waiters[i]
+                self._queued -= 1
+                if not waiters:
+                    del self._waiting[conversation_id]
+                # It may have been the head waiter holding up the others
+                self._dispatch()
+                return
+
+    def _release(self, reserved, used):
+        self._active -= 1
+        if used:
+            self._limit = min(float(self.max_concurrency), self._limit + 1 / self._limit)
+        if self.tokens_per_minute:
+            # Refund an over-estimate, or charge for an under-estimate
+            self._tokens += reserved - used
+        self._dispatch()
+
+    def _backoff(self, attempt, error):
+        retry_after = None
+        if isinstance(error, openai.APIStatusError):
+            retry_after = error.response.headers.get("retry-after")
+        if retry_after is not None:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        return random.uniform(0, min(LLM_MAX_BACKOFF, 0.5 * 2 ** attempt))
+
+    async def create(self, conversation_id, **kwargs):
+        """Queue, then run `chat.completions.create(**kwargs)` with retries.
+
+        A retried call gives up its slot while it backs off and queues again.
+        With `stream=True` the returned stream holds its slot until it is
+        exhausted or closed; only opening the stream is retried.
+        """
+        prompt_tokens = count_tokens(kwargs["messages"])
+        reserved = prompt_tokens + kwargs.get("max_tokens", LLM_COMPLETION_TOKEN_ESTIMATE)
+        attempt = 0
+        while True:
+            with span("llm_queue"):
+                await self._acquire(conversation_id, reserved)
+            try:
+                response = await self.client.chat.completions.create(**kwargs)
+                break
+            except _RETRYABLE as e:
+                delay = self._backoff(attempt, e)
+                if isinstance(e, openai.RateLimitError):
+                    self.rate_limited += 1
+                    now = time.monotonic()
+                    # Halve once per burst of 429s, not once per call that hit it
+                    if now >= self._paused_until:
+                        self._limit = max(1.0, self._limit / 2)
+                    # Hold back everyone else too until the limit has reset
+                    self._paused_until = max(self._paused_until, now + delay)
+                self._release(reserved, 0)
+                if attempt >= self.max_retries:
+                    raise LLMUnavailable(f"LLM unavailable after {attempt + 1} attempts: {e}", retry_after=delay)
+                self.retries += 1
+                attempt += 1
+                await asyncio.sleep(delay)
+            except BaseException:
+                self._release(reserved, 0)
+                raise
+        if kwargs.get("stream"):
+            return GatewayStream(response, lambda used: self._release(reserved, used), prompt_tokens)
+        usage = getattr(response, "usage", None)
+        self._release(reserved, usage.total_tokens if usage else reserved)
+        return response
+
+    def queue_depth(self):
+        return self._queued
+
+    def in_flight(self):
+        return self._active
+
+    def concurrency_limit(self):
+        return int(self._limit)
+
+
+class GatewayStream:
+    """A completion stream that gives its gateway slot back when it ends."""
+
+    def __init__(self, stream, release, prompt_tokens):
+        self._stream = stream
+        self._release = release
+        self._used = prompt_tokens
+
+    async def __aiter__(self):
+        try:
+            async for chunk in self._stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    self._used += count_text_tokens(chunk.choices[0].delta.content)
+                yield chunk
+        finally:
+            await self.close()
+
+    async def close(self):
+        if self._release is None:
+            return
+        release, self._release = self._release, None
+        release(self._used)
+        await self._stream.close()
+
+
+llm_gateway = LLMGateway(
+    max_concurrency=LLM_MAX_CONCURRENCY,
+    tokens_per_minute=LLM_TOKENS_PER_MINUTE,
+    max_retries=LLM_MAX_RETRIES,
+    queue_timeout=LLM_QUEUE_TIMEOUT
+)
+
+registry.gauge("tutor_llm_queue_depth", "LLM calls waiting for a gateway slot.", llm_gateway.queue_depth)
+registry.gauge("tutor_llm_in_flight", "LLM calls currently holding a gateway slot.", llm_gateway.in_flight)
+registry.gauge("tutor_llm_concurrency_limit", "Current adaptive limit on concurrent LLM calls.", llm_gateway.concurrency_limit)
+registry.counter("tutor_llm_retries_total", "LLM calls retried after a transient error.", lambda: llm_gateway.retries)
+registry.counter("tutor_llm_rate_limited_total", "429 responses received from the LLM.", lambda: llm_gateway.rate_limited)
+registry.counter("tutor_llm_rejected_total", "LLM calls rejected after waiting LLM_QUEUE_TIMEOUT.", lambda: llm_gateway.rejected)
@@ -0,0 +1,57 @@
+"""Concurrent-conversation load test for the tutor API.
+
+Start the fake OpenAI server and the API (see README), then run:
+
+    python load_test.py --concurrency 20
+
+Each simulated student creates a conversation and sends one message at the same
+time. If requests were serialized on the event loop, the wall time would be
+roughly concurrency x single-request latency; with non-blocking I/O it stays
+close to a single request's latency.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+
+async def one_conversation(client: httpx.AsyncClient, message: str) -> float:
+    conversation = (await client.post("/conversations")).json()
+    start = time.perf_counter()
+    response = await client.post(
+        f"/conversations/{conversation['id']}/messages",
+        json={"message": message}
+    )
+    response.raise_for_status()
+    return time.perf_counter() - start
+
+
+async def run(base_url: str, concurrency: int, message: str):
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120) as client:
+        # Warm up connections and measure a single request on its own
+        baseline = await one_conversation(client, message)
+
+        start = time.perf_counter()
+        latencies = await asyncio.gather(
+            *(one_conversation(client, message) for _ in range(concurrency))
+        )
+        wall = time.perf_counter() - start
+
+    print(f"Single request latency:  {baseline:.3f}s")
+    print(f"Concurrent requests:     {concurrency}")
+    print(f"Wall time:               {wall:.3f}s")
+    print(f"Median latency:          {statistics.median(latencies):.3f}s")
+    print(f"Max latency:             {max(latencies):.3f}s")
+    print(f"Serialization factor:    {wall / baseline:.2f} (1.0 = fully concurrent, {concurrency} = serialized)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--message", default="Explain photosynthesis in one paragraph.")
+    args = parser.parse_args()
+    asyncio.run(run(args.base_url, args.concurrency, args.message))
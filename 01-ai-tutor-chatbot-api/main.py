@@ -1,17 +1,84 @@
 from fastapi import FastAPI, Request, HTTPException, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from openai import OpenAI
+from fastapi.responses import StreamingResponse, PlainTextResponse
+from starlette.background import BackgroundTask
+from openai import AsyncOpenAI
+import httpx
 import os
+import json
+import math
 from dotenv import load_dotenv
 from typing import List, Optional
 from datetime import datetime
+from contextlib import asynccontextmanager
 
-from database import supabase
+import database
+from database import table, execute
+from history_cache import history_cache
+from context_window import build_context, count_tokens
+from response_cache import response_cache
+from metrics import registry, span, timing_middleware
+from llm_gateway import llm_gateway, LLMUnavailable
+from title_jobs import title_jobs
+from persistence import MessageWriter, ConversationNotFound, message_row
+from pagination import (
+    CONVERSATION_FIELDS, MESSAGE_FIELDS, DEFAULT_PAGE_SIZE,
+    parse_fields, check_limit, keyset_page, stream_page
+)
+from export_import import export_response, import_records
 
 # Load environment variables
 load_dotenv()
 
-app = FastAPI()
+# Clients are created per worker process in the lifespan below, never at import
+# time, so a preloading process manager cannot leak sockets across forks.
+client: AsyncOpenAI = None
+
+def create_openai_client():
+    # One async client with a pooled HTTP connection set is shared by every
+    # request, so concurrent completions never block each other.
+    return AsyncOpenAI(
+        api_key=os.getenv("OPENAI_API_KEY"),
+        http_client=httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=int(os.getenv("OPENAI_MAX_CONNECTIONS", "100")),
+                max_keepalive_connections=int(os.getenv("OPENAI_MAX_KEEPALIVE", "20"))
+            ),
+            timeout=httpx.Timeout(60.0, connect=5.0)
+        ),
+        # Retries are done by the LLM gateway, which also backs off other callers
+        max_retries=0
+    )
+
+async def warm_up():
+    """Open connections to OpenAI and Supabase before the first request arrives."""
+    try:
+        await client.models.list()
+    except Exception as e:
+        print(f"OpenAI warm-up failed: {e}")
+    try:
+        await execute(table("conversations").select("id").limit(1))
+    except Exception as e:
+        print(f"Supabase warm-up failed: {e}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global client
+    client = create_openai_client()
+    llm_gateway.bind(client)
+    database.connect()
+    await message_writer.start()
+    await warm_up()
+    await title_jobs.start()
+    yield
+    # Uvicorn has stopped accepting requests and finished in-flight ones by now;
+    # flush queued writes before the pools go away
+    await title_jobs.stop()
+    await message_writer.stop()
+    await client.close()
+    database.close()
+
+app = FastAPI(lifespan=lifespan)
 
 # Add CORS middleware
 app.add_middleware(
@@ -20,10 +87,81 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "X-Next-Cursor"],
 )
 
-# OpenAI configuration
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# Record per-phase latency and return it in a Server-Timing header
+app.middleware("http")(timing_middleware)
+
+def cache_written_messages(rows):
+    for row in rows:
+        history_cache.extend(row["conversation_id"], [row])
+
+# Both turns of an exchange are persisted with a single bulk insert
+message_writer = MessageWriter(on_written=cache_written_messages)
+
+# "delta" re-reads only rows newer than the last row read from Supabase, so
+# writes from other workers are picked up, even ones older than this worker's
+# own. It is the default because it is correct with any number of workers, but
+# it still costs one small Supabase read per turn. "local" trusts the cache
+# until its TTL expires and makes no read on a hit; it is only safe when a
+# conversation is always served by the same worker (one worker, or sticky
+# routing by conversation id).
+HISTORY_CACHE_SYNC = os.getenv("HISTORY_CACHE_SYNC", "delta")
+
+async def fetch_history(conversation_id: int, after_id: int = 0):
+    query = table("messages").select("id, role, content").eq("conversation_id", conversation_id)
+    if after_id:
+        query = query.gt("id", after_id)
+    messages = await execute(query.order("id"))
+    return messages.data
+
+async def load_history(conversation_id: int):
+    """Return the stored conversation history, using the in-process cache when possible."""
+    entry = history_cache.get(conversation_id)
+    if entry is None:
+        rows = await fetch_history(conversation_id)
+        history_cache.put(conversation_id, rows)
+    elif HISTORY_CACHE_SYNC == "delta":
+        rows = await fetch_history(conversation_id, entry.synced_id)
+        history_cache.extend(conversation_id, rows, synced=True)
+
+    history = history_cache.history(conversation_id)
+    if history is None:
+        # Larger than the whole cache, so it was evicted straight away
+        rows = await fetch_history(conversation_id)
+        history = [{"role": row["role"], "content": row["content"]} for row in rows]
+
+    # Messages queued for a deferred write are not in Supabase yet
+    return history + message_writer.pending(conversation_id)
+
+def user_turns(conversation_history: list):
+    return sum(1 for message in conversation_history if message["role"] == "user")
+
+def is_cacheable(conversation_history: list, data: dict):
+    """Whether a reply may come from (and go into) the response cache.
+
+    Only a conversation's opening question is cached, since earlier turns could
+    change the answer. Clients can bypass the cache with `"cache": false`.
+    """
+    return response_cache is not None and not conversation_history and data.get("cache", True) is not False
+
+def cache_hit_stats(conversation_history: list):
+    full_tokens = count_tokens(conversation_history)
+    return {
+        "prompt_tokens": 0,
+        "full_history_tokens": full_tokens,
+        "prompt_tokens_saved": full_tokens,
+        "summarized_messages": 0
+    }
+
+def overloaded(error: LLMUnavailable):
+    # Tell the client when to come back instead of failing with an opaque 500
+    return HTTPException(
+        status_code=503,
+        detail=str(error),
+        headers={"Retry-After": str(math.ceil(error.retry_after))}
+    )
 
 @app.get("/")
 async def read_root():
@@ -33,40 +171,79 @@ async def read_root():
 async def create_conversation():
     try:
         # Create a new conversation in Supabase
-        conversation = supabase.table("conversations").insert({
+        conversation = await execute(table("conversations").insert({
             "title": "New Conversation",
             "created_at": datetime.utcnow().isoformat()
-        }).execute()
+        }))
         
         return conversation.data[0]
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/conversations")
-async def get_conversations():
+async def get_conversations(
+    cursor: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE,
+    fields: Optional[str] = None
+):
+    columns = parse_fields(fields, CONVERSATION_FIELDS)
+    check_limit(limit)
+    query = keyset_page(table("conversations").select(columns), cursor, limit)
     try:
-        conversations = supabase.table("conversations").select("*").execute()
-        return conversations.data
+        conversations = await execute(query)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    return stream_page(conversations.data, limit)
 
 @app.get("/conversations/{conversation_id}")
 async def get_conversation(conversation_id: int):
     try:
-        conversation = supabase.table("conversations").select("*").eq("id", conversation_id).execute()
+        conversation = await execute(table("conversations").select("*").eq("id", conversation_id))
         if not conversation.data:
             raise HTTPException(status_code=404, detail="Conversation not found")
         return conversation.data[0]
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/export")
+async def export_data(cursor: Optional[str] = None, gzip: bool = False):
+    return export_response(cursor, gzip)
+
+@app.post("/import")
+async def import_data(request: Request):
+    return await import_records(request)
+
+@app.get("/metrics")
+async def get_metrics():
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/cache/stats")
+async def get_cache_stats():
+    return {
+        **history_cache.stats(),
+        "message_writer": message_writer.stats(),
+        "response_cache": response_cache.stats() if response_cache else None
+    }
+
 @app.get("/conversations/{conversation_id}/messages")
-async def get_messages(conversation_id: int):
+async def get_messages(
+    conversation_id: int,
+    cursor: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE,
+    fields: Optional[str] = None
+):
+    columns = parse_fields(fields, MESSAGE_FIELDS)
+    check_limit(limit)
+    query = keyset_page(
+        table("messages").select(columns).eq("conversation_id", conversation_id),
+        cursor,
+        limit
+    )
     try:
-        messages = supabase.table("messages").select("*").eq("conversation_id", conversation_id).execute()
-        return messages.data
+        messages = await execute(query)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    return stream_page(messages.data, limit)
 
 @app.post("/conversations/{conversation_id}/messages")
 async def create_message(conversation_id: int, request: Request):
@@ -76,40 +253,177 @@ async def create_message(conversation_id: int, request: Request):
         user_message = data.get("message")
         if not user_message:
             raise HTTPException(status_code=400, detail="Message is required")
-        
-        # Save user message to Supabase
-        user_msg = supabase.table("messages").insert({
-            "conversation_id": conversation_id,
-            "role": "user",
-            "content": user_message,
-            "created_at": datetime.utcnow().isoformat()
-        }).execute()
+
+        # The user message is saved together with the reply below
+        user_row = message_row(conversation_id, "user", user_message)
+        # Deferred rows for an unknown conversation would never insert
+        await message_writer.check_conversation(conversation_id)
         
         # Get conversation history
-        messages = supabase.table("messages").select("*").eq("conversation_id", conversation_id).execute()
-        conversation_history = [
-            {"role": msg["role"], "content": msg["content"]}
-            for msg in messages.data
-        ]
+        with span("history"):
+            conversation_history = await load_history(conversation_id)
+        cacheable = is_cacheable(conversation_history, data)
+        conversation_history.append({"role": "user", "content": user_message})
+
+        # Reuse a cached reply to the same question when there is one
+        ai_response, cache_tier = None, None
+        if cacheable:
+            with span("response_cache"):
+                ai_response, cache_tier = response_cache.get(user_message, "gpt-3.5-turbo")
+
+        if ai_response is not None:
+            context_stats = cache_hit_stats(conversation_history)
+        else:
+            # Fit the history into the token budget
+            with span("context"):
+                context, context_stats = await build_context(llm_gateway, conversation_id, conversation_history)
+
+            # Get AI response
+            try:
+                with span("llm"):
+                    response = await llm_gateway.create(
+                        conversation_id,
+                        model="gpt-3.5-turbo",
+                        messages=context
+                    )
+            except Exception:
+                # Keep the student's question even when the completion fails
+                await message_writer.write([user_row])
+                raise
+            ai_response = response.choices[0].message.content
+            if cacheable:
+                response_cache.put(user_message, "gpt-3.5-turbo", ai_response)
         
-        # Get AI response
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=conversation_history + [{"role": "user", "content": user_message}]
-        )
-        ai_response = response.choices[0].message.content
-        
-        # Save AI response to Supabase
-        ai_msg = supabase.table("messages").insert({
-            "conversation_id": conversation_id,
-            "role": "assistant",
-            "content": ai_response,
-            "created_at": datetime.utcnow().isoformat()
-        }).execute()
+        # Save both messages to Supabase in one round trip
+        with span("persist"):
+            await message_writer.write([user_row, message_row(conversation_id, "assistant", ai_response)])
+        # Titles are generated in the background, off the request path
+        title_jobs.on_turn(conversation_id, user_turns(conversation_history))
         
         return {
             "user_message": user_message,
-            "ai_response": ai_response
+            "ai_response": ai_response,
+            "context": context_stats,
+            "cached": cache_tier
         }
+    except ConversationNotFound:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    except LLMUnavailable as e:
+        raise overloaded(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/conversations/{conversation_id}/messages/stream")
+async def create_message_stream(conversation_id: int, request: Request):
+    # Get user message from request
+    data = await request.json()
+    user_message = data.get("message")
+    if not user_message:
+        raise HTTPException(status_code=400, detail="Message is required")
+
+    # The user message is saved together with the reply once the stream ends
+    user_row = message_row(conversation_id, "user", user_message)
+
+    try:
+        await message_writer.check_conversation(conversation_id)
+        # Get conversation history
+        with span("history"):
+            conversation_history = await load_history(conversation_id)
+        cacheable = is_cacheable(conversation_history, data)
+        conversation_history.append({"role": "user", "content": user_message})
+
+        cached_response, cache_tier = None, None
+        if cacheable:
+            with span("response_cache"):
+                cached_response, cache_tier = response_cache.get(user_message, "gpt-3.5-turbo")
+
+        if cached_response is not None:
+            context_stats = cache_hit_stats(conversation_history)
+            stream = None
+        else:
+            with span("context"):
+                context, context_stats = await build_context(llm_gateway, conversation_id, conversation_history)
+
+            # Open the stream before responding so connection errors still surface as a 500
+            # (finish() below closes it even if the body is never sent)
+            with span("llm_first_byte"):
+                stream = await llm_gateway.create(
+                    conversation_id,
+                    model="gpt-3.5-turbo",
+                    messages=context,
+                    stream=True
+                )
+    except ConversationNotFound:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    except LLMUnavailable as e:
+        raise overloaded(e)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    # Set once the generator has taken over saving the user message
+    saved = False
+
+    async def event_stream():
+        nonlocal saved
+        if stream is None:
+            # Cached reply: send it in one event
+            yield f"data: {json.dumps({'token': cached_response})}\n\n"
+            saved = True
+            await message_writer.write([user_row, message_row(conversation_id, "assistant", cached_response)])
+            title_jobs.on_turn(conversation_id, user_turns(conversation_history))
+            yield "data: [DONE]\n\n"
+            return
+
+        # Forward tokens as server-sent events while collecting the full reply
+        chunks = []
+        try:
+            with span("llm_stream"):
+                async for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    token = chunk.choices[0].delta.content
+                    if token:
+                        chunks.append(token)
+                        yield f"data: {json.dumps({'token': token})}\n\n"
+        except Exception as e:
+            saved = True
+            await message_writer.write([user_row])
+            yield f"event: error\ndata: {json.dumps({'detail': str(e)})}\n\n"
+            return
+        finally:
+            await stream.close()
+
+        # Save both messages to Supabase in one round trip once the stream has finished
+        ai_response = "".join(chunks)
+        if cacheable:
+            response_cache.put(user_message, "gpt-3.5-turbo", ai_response)
+        saved = True
+        with span("persist"):
+            await message_writer.write([user_row, message_row(conversation_id, "assistant", ai_response)])
+        title_jobs.on_turn(conversation_id, user_turns(conversation_history))
+        yield "data: [DONE]\n\n"
+
+    async def finish():
+        # Runs after the response even when the client disconnected, which may be
+        # before the generator started or while it was waiting on a token
+        if stream is not None:
+            await stream.close()
+        if not saved:
+            # Keep the student's question even though the reply was never finished
+            try:
+                await message_writer.write([user_row])
+            except Exception as e:
+                print(f"Saving the message of an abandoned stream failed: {e}")
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        background=BackgroundTask(finish),
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+            "X-Prompt-Tokens": str(context_stats["prompt_tokens"]),
+            "X-Prompt-Tokens-Saved": str(context_stats["prompt_tokens_saved"]),
+            "X-Response-Cache": cache_tier or "miss"
+        }
+    )
@@ -0,0 +1,147 @@
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+import bisect
+import time
+
+from fastapi import Request
+
+# Prometheus-style latency buckets in seconds, from cache hits up to slow completions
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUANTILES = (0.5, 0.95, 0.99)
+# Quantiles are computed over the most recent observations of each series
+WINDOW = 1024
+
+# Spans recorded by the request currently being handled
+_request_spans = ContextVar("request_spans", default=None)
+
+
+class Histogram:
+    """Cumulative buckets for aggregation plus a sliding window for quantiles."""
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.window = deque(maxlen=WINDOW)
+
+    def observe(self, value):
+        index = bisect.bisect_left(BUCKETS, value)
+        if index < len(BUCKETS):
+            self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+        self.window.append(value)
+
+    def quantile(self, q):
+        if not self.window:
+            return 0.0
+        values = sorted(self.window)
+        return values[min(int(q * len(values)), len(values) - 1)]
+
+
+class Registry:
+    def __init__(self):
+        self.requests = {}
+        self.phases = {}
+        # (name, help, type, read) for values owned by other modules, read at scrape time
+        self.values = []
+
+    def _series(self, family, labels):
+        histogram = family.get(labels)
+        if histogram is None:
+            histogram = family[labels] = Histogram()
+        return histogram
+
+    def observe_request(self, method, route, status, seconds):
+        self._series(self.requests, (("method", method), ("route", route), ("status", str(status)))).observe(seconds)
+
+    def observe_phase(self, phase, seconds):
+        self._series(self.phases, (("phase", phase),)).observe(seconds)
+
+    def gauge(self, name, help_text, read):
+        self.values.append((name, help_text, "gauge", read))
+
+    def counter(self, name, help_text, read):
+        self.values.append((name, help_text, "counter", read))
+
+    def render(self):
+        lines = []
+        for name, help_text, family in (
+            ("tutor_request_duration_seconds", "End-to-end request latency.", self.requests),
+            ("tutor_phase_duration_seconds", "Latency of each phase within a request.", self.phases),
+        ):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            for labels, histogram in family.items():
+                cumulative = 0
+                for bound, count in zip(BUCKETS, histogram.counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_labels(labels, ('le', str(bound)))} {cumulative}")
+                lines.append(f"{name}_bucket{_labels(labels, ('le', '+Inf'))} {histogram.count}")
+                lines.append(f"{name}_sum{_labels(labels)} {histogram.sum:.6f}")
+                lines.append(f"{name}_count{_labels(labels)} {histogram.count}")
+
+            summary = f"{name.rsplit('_seconds', 1)[0]}_quantile_seconds"
+            lines.append(f"# HELP {summary} {help_text} Quantiles over the last {WINDOW} observations.")
+            lines.append(f"# TYPE {summary} summary")
+            for labels, histogram in family.items():
+                for q in QUANTILES:
+                    lines.append(f"{summary}{_labels(labels, ('quantile', str(q)))} {histogram.quantile(q):.6f}")
+                lines.append(f"{summary}_sum{_labels(labels)} {histogram.sum:.6f}")
+                lines.append(f"{summary}_count{_labels(labels)} {histogram.count}")
+
+        for name, help_text, kind, read in self.values:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.append(f"{name} {read()}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels, extra=None):
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in pairs) + "}"
+
+
+registry = Registry()
+
+
+@contextmanager
+def span(name):
+    """Time a phase of the current request.
+
+    The duration feeds the phase histogram and, when the response has not been
+    sent yet, the request's Server-Timing header.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        registry.observe_phase(name, elapsed)
+        spans = _request_spans.get()
+        if spans is not None:
+            spans.append((name, elapsed))
+
+
+async def timing_middleware(request: Request, call_next):
+    spans = []
+    token = _request_spans.set(spans)
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        _request_spans.reset(token)
+    elapsed = time.perf_counter() - start
+
+    # Label by route template so ids in the path do not explode cardinality
+    route = request.scope.get("route")
+    path = route.path if route is not None else "unmatched"
+    registry.observe_request(request.method, path, response.status_code, elapsed)
+
+    timings = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in spans]
+    timings.append(f"total;dur={elapsed * 1000:.1f}")
+    response.headers["Server-Timing"] = ", ".join(timings)
+    return response
@@ -0,0 +1,88 @@
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from datetime import datetime
+import base64
+import json
+import re
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+CONVERSATION_FIELDS = {"id", "title", "created_at"}
+MESSAGE_FIELDS = {"id", "conversation_id", "role", "content", "created_at"}
+
+# Keyset columns are always selected so the next cursor can be built
+_KEYSET_FIELDS = ("created_at", "id")
+
+# An ISO 8601 timestamp as PostgREST returns it; the cursor value goes into a raw filter
+_TIMESTAMP = re.compile(r"\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}(\.\d{1,6})?(Z|[+-]\d{2}(:?\d{2})?)?")
+
+
+def encode_cursor(row):
+    raw = json.dumps([row["created_at"], row["id"]]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(cursor):
+    """Return (created_at, id) from a cursor, rejecting anything that isn't a timestamp and an int."""
+    try:
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not isinstance(created_at, str) or not _TIMESTAMP.fullmatch(created_at):
+            raise ValueError("created_at is not a timestamp")
+        # Also rejects impossible dates such as 2024-13-45
+        datetime.strptime(created_at[:19].replace(" ", "T"), "%Y-%m-%dT%H:%M:%S")
+        if not isinstance(row_id, int) or isinstance(row_id, bool):
+            raise ValueError("id is not an integer")
+        return created_at, row_id
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def parse_fields(fields, allowed):
+    """Turn a `fields=` query value into a PostgREST select list."""
+    if not fields:
+        return "*"
+    requested = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = set(requested) - allowed
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    for column in _KEYSET_FIELDS:
+        if column not in requested:
+            requested.append(column)
+    return ", ".join(requested)
+
+
+def check_limit(limit):
+    if limit < 1 or limit > MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    return limit
+
+
+def keyset_page(query, cursor, limit):
+    """Order a query by (created_at, id) and restrict it to the page after `cursor`.
+
+    One extra row is requested so the caller can tell whether another page exists.
+    """
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        # postgrest-py 0.11 has no or_() builder, so the filter is added as a raw param
+        query.params = query.params.add(
+            "or", f'(created_at.gt."{created_at}",and(created_at.eq."{created_at}",id.gt.{row_id}))'
+        )
+    return query.order("created_at,id").limit(limit + 1)
+
+
+def stream_page(rows, limit):
+    """Stream one page of rows as a JSON array, with the next cursor in a header."""
+    headers = {}
+    if len(rows) > limit:
+        rows = rows[:limit]
+        headers["X-Next-Cursor"] = encode_cursor(rows[-1])
+
+    def body():
+        yield "["
+        for i, row in enumerate(rows):
+            yield ("," if i else "") + json.dumps(row)
+        yield "]"
+
+    return StreamingResponse(body(), media_type="application/json", headers=headers)
@@ -0,0 +1,181 @@
+import asyncio
+import os
+import random
+from datetime import datetime
+
+from database import table, execute
+
+# "sync" writes each exchange with one bulk insert before the response is sent.
+# "deferred" queues the rows and a background task flushes them in batches.
+MESSAGE_WRITE_MODE = os.getenv("MESSAGE_WRITE_MODE", "sync")
+FLUSH_BATCH_SIZE = int(os.getenv("MESSAGE_FLUSH_BATCH_SIZE", "100"))
+FLUSH_INTERVAL = float(os.getenv("MESSAGE_FLUSH_INTERVAL", "0.05"))
+FLUSH_QUEUE_SIZE = int(os.getenv("MESSAGE_FLUSH_QUEUE_SIZE", "1000"))
+FLUSH_MAX_ATTEMPTS = int(os.getenv("MESSAGE_FLUSH_MAX_ATTEMPTS", "8"))
+FLUSH_MAX_BACKOFF = 5.0
+# Conversation ids already checked to exist, so the lookup is made once per worker
+KNOWN_CONVERSATIONS = 10000
+
+
+class ConversationNotFound(LookupError):
+    pass
+
+
+def message_row(conversation_id, role, content):
+    return {
+        "conversation_id": conversation_id,
+        "role": role,
+        "content": content,
+        "created_at": datetime.utcnow().isoformat()
+    }
+
+
+class MessageWriter:
+    """Persists messages in bulk, optionally off the request path.
+
+    A deferred batch is retried with backoff up to FLUSH_MAX_ATTEMPTS times, so
+    delivery is at-least-once: a batch whose insert succeeded but whose
+    response was lost is written again. A batch that still fails is split in
+    halves until the rows that keep failing are found; those are logged and
+    dropped so they cannot block the queue. Rows not yet flushed are visible
+    through `pending()` so the next turn in the same worker still sees them.
+    """
+
+    def __init__(self, on_written=None):
+        self.on_written = on_written
+        self._queue = None
+        self._task = None
+        self._pending = {}
+        self._known = {}
+        self.flushed_batches = 0
+        self.flushed_rows = 0
+        self.failed_flushes = 0
+        self.dropped_rows = 0
+
+    @property
+    def deferred(self):
+        return self._task is not None
+
+    async def start(self):
+        if MESSAGE_WRITE_MODE == "deferred" and self._task is None:
+            self._queue = asyncio.Queue(maxsize=FLUSH_QUEUE_SIZE)
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """Flush everything still queued, then stop the background task."""
+        if self._task is None:
+            return
+        await self._queue.join()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def check_conversation(self, conversation_id):
+        """Raise ConversationNotFound before rows for a missing conversation are queued.
+
+        Sync writes report the failed insert to the request themselves, so only
+        deferred mode looks the conversation up.
+        """
+        if not self.deferred or conversation_id in self._known:
+            return
+        result = await execute(table("conversations").select("id").eq("id", conversation_id))
+        if not result.data:
+            raise ConversationNotFound(conversation_id)
+        self._known[conversation_id] = True
+        if len(self._known) > KNOWN_CONVERSATIONS:
+            del self._known[next(iter(self._known))]
+
+    async def write(self, rows):
+        """Insert rows in one round trip, or queue them when deferred.
+
+        Returns the inserted rows (with ids) when written synchronously, or an
+        empty list when they were queued.
+        """
+        if not self.deferred:
+            result = await execute(table("messages").insert(rows))
+            if self.on_written:
+                self.on_written(result.data)
+            return result.data
+        for row in rows:
+            self._pending.setdefault(row["conversation_id"], []).append(row)
+            # Blocks when the queue is full, pushing back on the request path
+            await self._queue.put(row)
+        return []
+
+    def pending(self, conversation_id):
+        return [
+            {"role": row["role"], "content": row["content"]}
+            for row in self._pending.get(conversation_id, [])
+        ]
+
+    def queue_depth(self):
+        return self._queue.qsize() if self._queue else 0
+
+    async def _flush_loop(self):
+        while True:
+            batch = [await self._queue.get()]
+            # Give concurrent turns a moment to join the batch
+            await asyncio.sleep(FLUSH_INTERVAL)
+            while len(batch) < FLUSH_BATCH_SIZE and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            await self._flush(batch)
+            for _ in batch:
+                self._queue.task_done()
+
+    async def _flush(self, batch):
+        written = await self._insert(batch, FLUSH_MAX_ATTEMPTS)
+        if written is None:
+            written = await self._isolate(batch)
+        for row in batch:
+            rows = self._pending.get(row["conversation_id"])
+            if rows:
+                rows.remove(row)
+                if not rows:
+                    del self._pending[row["conversation_id"]]
+        if written and self.on_written:
+            self.on_written(written)
+
+    async def _insert(self, batch, attempts):
+        """Insert with backoff; returns the written rows, or None once `attempts` tries failed."""
+        backoff = 0.1
+        for attempt in range(1, attempts + 1):
+            try:
+                result = await execute(table("messages").insert(batch))
+            except Exception as e:
+                self.failed_flushes += 1
+                print(f"Message flush of {len(batch)} rows failed (attempt {attempt}/{attempts}): {e}")
+                if attempt < attempts:
+                    await asyncio.sleep(backoff * random.uniform(0.5, 1.5))
+                    backoff = min(backoff * 2, FLUSH_MAX_BACKOFF)
+                continue
+            self.flushed_batches += 1
+            self.flushed_rows += len(batch)
+            return result.data
+        return None
+
+    async def _isolate(self, batch):
+        """Bisect a failing batch, one attempt per half, and drop the rows that fail alone."""
+        if len(batch) == 1:
+            row = batch[0]
+            self.dropped_rows += 1
+            print(f"Dropping {row['role']} message for conversation {row['conversation_id']}: insert keeps failing")
+            return []
+        middle = len(batch) // 2
+        written = []
+        for half in (batch[:middle], batch[middle:]):
+            rows = await self._insert(half, 1)
+            written += rows if rows is not None else await self._isolate(half)
+        return written
+
+    def stats(self):
+        return {
+            "mode": "deferred" if self.deferred else "sync",
+            "queue_depth": self.queue_depth(),
+            "flushed_batches": self.flushed_batches,
+            "flushed_rows": self.flushed_rows,
+            "failed_flushes": self.failed_flushes,
+            "dropped_rows": self.dropped_rows
+        }
@@ -0,0 +1,145 @@
+import hashlib
+import os
+import re
+import time
+import zlib
+
+import numpy as np
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "false").lower() == "true"
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "10000"))
+# Cosine similarity needed for a semantic hit; set above 1 to disable that tier
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0.92"))
+
+_EMBEDDING_DIM = 512
+# Words and numbers, plus single symbols so "2x+3" and "2x-3" stay distinct
+_TOKEN_RE = re.compile(r"[a-z0-9]+|[^\sa-z0-9]")
+# Sentence punctuation that does not change what is being asked
+_IGNORED = set("?!.,;:'\"")
+
+
+def normalize_prompt(text):
+    return " ".join(t for t in _TOKEN_RE.findall(text.lower()) if t not in _IGNORED)
+
+
+def _symbols(normalized):
+    """Numbers and operators in a question; a semantic hit must match them exactly."""
+    return tuple(t for t in normalized.split() if not t.isalpha())
+
+
+def embed(text):
+    """Hash word and character-trigram features into a unit vector.
+
+    This is a local, dependency-light embedding that is good at matching
+    near-identical wordings of the same question, which is what repeated
+    homework prompts look like.
+    """
+    vector = np.zeros(_EMBEDDING_DIM, dtype=np.float32)
+    words = text.split()
+    features = words + [text[i:i + 3] for i in range(len(text) - 2)]
+    for feature in features:
+        vector[zlib.crc32(feature.encode()) % _EMBEDDING_DIM] += 1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class ResponseCache:
+    """Exact-hash and embedding-similarity cache of LLM replies.
+
+    Vectors live in a preallocated matrix so a lookup is a single
+    matrix-vector product over the live slots.
+    """
+
+    def __init__(self, max_entries, ttl, similarity):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity = similarity
+        self._exact = {}
+        self._vectors = np.zeros((max_entries, _EMBEDDING_DIM), dtype=np.float32)
+        self._live = np.zeros(max_entries, dtype=bool)
+        self._slots = [None] * max_entries
+        self._free = list(range(max_entries - 1, -1, -1))
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    def _key(self, normalized, model):
+        return hashlib.sha256(f"{model}\0{normalized}".encode()).hexdigest()
+
+    def _remove(self, slot):
+        key = self._slots[slot][0]
+        self._exact.pop(key, None)
+        self._slots[slot] = None
+        self._live[slot] = False
+        self._free.append(slot)
+
+    def _expire(self):
+        now = time.monotonic()
+        for slot, entry in enumerate(self._slots):
+            if entry is not None and entry[3] <= now:
+                self._remove(slot)
+
+    def get(self, prompt, model):
+        """Return (response, tier) for a cached prompt, or (None, None) on a miss."""
+        normalized = normalize_prompt(prompt)
+        now = time.monotonic()
+
+        slot = self._exact.get(self._key(normalized, model))
+        if slot is not None:
+            _, _, response, expires_at, _ = self._slots[slot]
+            if expires_at > now:
+                self.exact_hits += 1
+                return response, "exact"
+            self._remove(slot)
+
+        if self.similarity <= 1 and self._live.any():
+            scores = self._vectors @ embed(normalized)
+            scores[~self._live] = -1.0
+            slot = int(np.argmax(scores))
+            _, entry_model, response, expires_at, symbols = self._slots[slot]
+            if (scores[slot] >= self.similarity and entry_model == model and expires_at > now
+                    and symbols == _symbols(normalized)):
+                self.semantic_hits += 1
+                return response, "semantic"
+
+        self.misses += 1
+        return None, None
+
+    def put(self, prompt, model, response):
+        normalized = normalize_prompt(prompt)
+        key = self._key(normalized, model)
+        if key in self._exact:
+            self._remove(self._exact[key])
+        if not self._free:
+            self._expire()
+        if not self._free:
+            # Still full: drop the entry closest to expiring
+            oldest = min(
+                (i for i, entry in enumerate(self._slots) if entry is not None),
+                key=lambda i: self._slots[i][3]
+            )
+            self._remove(oldest)
+        slot = self._free.pop()
+        self._vectors[slot] = embed(normalized)
+        self._live[slot] = True
+        self._slots[slot] = (key, model, response, time.monotonic() + self.ttl, _symbols(normalized))
+        self._exact[key] = slot
+
+    def stats(self):
+        lookups = self.exact_hits + self.semantic_hits + self.misses
+        return {
+            "entries": int(self._live.sum()),
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_rate": (self.exact_hits + self.semantic_hits) / lookups if lookups else 0.0
+        }
+
+
+# Opt-in: the vector matrix is preallocated, so nothing is built unless enabled
+response_cache = ResponseCache(
+    max_entries=RESPONSE_CACHE_MAX_ENTRIES,
+    ttl=RESPONSE_CACHE_TTL,
+    similarity=RESPONSE_CACHE_SIMILARITY
+) if RESPONSE_CACHE_ENABLED else None
@@ -0,0 +1,34 @@
+"""Concurrent conversations are served in parallel, not one after another.
+
+Checks that OpenAI and Supabase I/O never blocks the event loop: load_test's
+conversations run against the API and stand-ins started by conftest.py.
+
+    python -m pytest test_concurrency.py
+"""
+import asyncio
+import time
+
+import httpx
+
+from load_test import one_conversation
+
+CONCURRENCY = 10
+
+
+def test_concurrent_conversations_take_about_one_request(stack):
+    async def scenario():
+        limits = httpx.Limits(max_connections=CONCURRENCY)
+        async with httpx.AsyncClient(base_url=stack.api, limits=limits, timeout=60) as client:
+            # Also warms up connections
+            baseline = await one_conversation(client, "What is a prime number?")
+            start = time.perf_counter()
+            # Distinct questions so no reply can come from a cache
+            await asyncio.gather(*(
+                one_conversation(client, f"What is {n} squared?") for n in range(CONCURRENCY)
+            ))
+            return baseline, time.perf_counter() - start
+
+    baseline, wall = asyncio.run(scenario())
+    assert baseline >= 14 * stack.token_delay * 0.8
+    # Serialized, the batch would take CONCURRENCY x baseline
+    assert wall < 2.5 * baseline, f"{CONCURRENCY} requests took {wall:.2f}s, one took {baseline:.2f}s"
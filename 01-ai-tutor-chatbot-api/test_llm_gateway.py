@@ -0,0 +1,143 @@
+"""LLMGateway admission control, driven by a stub OpenAI client.
+
+    python -m pytest test_llm_gateway.py
+"""
+import asyncio
+import time
+from types import SimpleNamespace
+
+import httpx
+import openai
+import pytest
+
+from llm_gateway import LLMGateway, LLMUnavailable
+
+
+def rate_limit_error(retry_after):
+    request = httpx.Request("POST", "http://llm.test/v1/chat/completions")
+    response = httpx.Response(429, headers={"retry-after": str(retry_after)}, request=request)
+    return openai.RateLimitError("Rate limit reached", response=response, body=None)
+
+
+class StubClient:
+    """Records when each call started; `fail` is a list of errors to raise first."""
+
+    def __init__(self, delay=0.01, fail=(), gate=None):
+        self.delay = delay
+        self.fail = list(fail)
+        self.gate = gate
+        self.started = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    async def create(self, **kwargs):
+        self.started.append((kwargs["messages"][0]["content"], time.monotonic()))
+        if self.fail:
+            raise self.fail.pop(0)
+        if self.gate is not None:
+            await self.gate.wait()
+        await asyncio.sleep(self.delay)
+        return SimpleNamespace(usage=SimpleNamespace(total_tokens=10))
+
+
+def gateway(client, max_concurrency=4, queue_timeout=5.0):
+    gw = LLMGateway(max_concurrency=max_concurrency, tokens_per_minute=0, max_retries=3, queue_timeout=queue_timeout)
+    gw.bind(client)
+    return gw
+
+
+def call(gw, conversation_id, label=None):
+    return gw.create(conversation_id, model="stub", max_tokens=5,
+                     messages=[{"role": "user", "content": label or str(conversation_id)}])
+
+
+def test_rate_limit_pauses_everyone_and_halves_the_limit():
+    async def scenario():
+        client = StubClient(fail=[rate_limit_error(0.3)])
+        gw = gateway(client, max_concurrency=8)
+        first = asyncio.create_task(call(gw, "a", "first"))
+        await asyncio.sleep(0.05)
+        # The 429 has been seen; this call must wait out the Retry-After too
+        second = asyncio.create_task(call(gw, "b", "second"))
+        await asyncio.gather(first, second)
+        return client, gw
+
+    client, gw = asyncio.run(scenario())
+    rate_limited_at = client.started[0][1]
+    later = [started for label, started in client.started[1:]]
+    assert all(started - rate_limited_at >= 0.29 for started in later)
+    assert gw.rate_limited == 1 and gw.retries == 1
+    # Halved from 8, then grows back by 1/limit per success
+    assert 4 <= gw._limit < 5
+    assert gw.queue_depth() == 0 and gw.in_flight() == 0
+
+
+def test_burst_of_rate_limits_halves_once():
+    async def scenario():
+        client = StubClient(fail=[rate_limit_error(0.2) for _ in range(4)])
+        gw = gateway(client, max_concurrency=8)
+        await asyncio.gather(*(call(gw, f"c{i}") for i in range(4)))
+        return gw
+
+    gw = asyncio.run(scenario())
+    assert gw.rate_limited == 4
+    assert 4 <= gw._limit < 5
+
+
+def test_busy_conversation_does_not_starve_others():
+    async def scenario():
+        client = StubClient()
+        gw = gateway(client, max_concurrency=1)
+        busy = [asyncio.create_task(call(gw, "busy", f"busy-{i}")) for i in range(6)]
+        await asyncio.sleep(0)
+        quiet = asyncio.create_task(call(gw, "quiet", "quiet"))
+        await asyncio.gather(*busy, quiet)
+        return [label for label, _ in client.started]
+
+    order = asyncio.run(scenario())
+    # Round-robin: the quiet conversation is served right after the busy one's next call
+    assert order.index("quiet") <= 2, order
+
+
+def test_queue_timeout_removes_the_waiter():
+    async def scenario():
+        gate = asyncio.Event()
+        client = StubClient(gate=gate)
+        gw = gateway(client, max_concurrency=1, queue_timeout=0.1)
+        holder = asyncio.create_task(call(gw, "holder"))
+        await asyncio.sleep(0)
+        for conversation_id in ("late-1", "late-2"):
+            with pytest.raises(LLMUnavailable):
+                await call(gw, conversation_id)
+        depth_after_timeouts = gw.queue_depth()
+        waiting = dict(gw._waiting)
+        gate.set()
+        await holder
+        # The slot is free again and nobody stale is ahead in the queue
+        await asyncio.wait_for(call(gw, "next"), 1)
+        return gw, depth_after_timeouts, waiting
+
+    gw, depth, waiting = asyncio.run(scenario())
+    assert depth == 0 and waiting == {}
+    assert gw.rejected == 2
+    assert gw.queue_depth() == 0 and gw.in_flight() == 0
+
+
+def test_cancelled_waiter_is_removed():
+    async def scenario():
+        gate = asyncio.Event()
+        gw = gateway(StubClient(gate=gate), max_concurrency=1)
+        holder = asyncio.create_task(call(gw, "holder"))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(call(gw, "gone"))
+        await asyncio.sleep(0.01)
+        assert gw.queue_depth() == 1
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        depth = gw.queue_depth()
+        gate.set()
+        await holder
+        return gw, depth
+
+    gw, depth = asyncio.run(scenario())
+    assert depth == 0 and gw._waiting == {}
+    assert gw.in_flight() == 0
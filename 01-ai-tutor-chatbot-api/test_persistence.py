@@ -0,0 +1,82 @@
+"""MessageWriter's deferred flushing, against a stub table instead of Supabase.
+
+    python -m pytest test_persistence.py
+"""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import persistence
+from persistence import ConversationNotFound, MessageWriter, message_row
+
+
+class StubTable:
+    """Inserts fail for rows of conversations in `bad`, like a foreign key violation."""
+
+    def __init__(self, conversations=(), bad=()):
+        self.conversations = set(conversations)
+        self.bad = set(bad)
+        self.rows = []
+        self.inserts = 0
+        self.lookups = 0
+
+    def table(self, name):
+        return SimpleNamespace(insert=lambda rows: ("insert", rows), select=lambda columns: self._select())
+
+    def _select(self):
+        return SimpleNamespace(eq=lambda column, value: ("select", value))
+
+    async def execute(self, query):
+        kind, payload = query
+        if kind == "select":
+            self.lookups += 1
+            return SimpleNamespace(data=[{"id": payload}] if payload in self.conversations else [])
+        self.inserts += 1
+        if any(row["conversation_id"] in self.bad for row in payload):
+            raise RuntimeError("violates foreign key constraint")
+        self.rows += payload
+        return SimpleNamespace(data=payload)
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    stub = StubTable(conversations={1, 2}, bad={99})
+    monkeypatch.setattr(persistence, "MESSAGE_WRITE_MODE", "deferred")
+    monkeypatch.setattr(persistence, "FLUSH_MAX_ATTEMPTS", 2)
+    monkeypatch.setattr(persistence, "table", stub.table)
+    monkeypatch.setattr(persistence, "execute", stub.execute)
+    return stub
+
+
+def test_failing_row_is_dropped_and_does_not_block_the_queue(stub):
+    async def scenario():
+        written = []
+        writer = MessageWriter(on_written=written.extend)
+        await writer.start()
+        await writer.write([message_row(1, "user", "a"), message_row(1, "assistant", "b")])
+        await writer.write([message_row(99, "user", "orphan")])
+        await writer.write([message_row(2, "user", "c")])
+        await asyncio.wait_for(writer.stop(), 10)
+        return writer, written
+
+    writer, written = asyncio.run(scenario())
+    assert [row["content"] for row in stub.rows] == ["a", "b", "c"]
+    assert [row["content"] for row in written] == ["a", "b", "c"]
+    assert writer.dropped_rows == 1 and writer.flushed_rows == 3
+    assert writer.pending(99) == [] and writer.queue_depth() == 0
+
+
+def test_unknown_conversation_is_rejected_before_queueing(stub):
+    async def scenario():
+        writer = MessageWriter()
+        await writer.start()
+        await writer.check_conversation(1)
+        await writer.check_conversation(1)
+        with pytest.raises(ConversationNotFound):
+            await writer.check_conversation(99)
+        await writer.stop()
+
+    asyncio.run(scenario())
+    # Known conversations are looked up once
+    assert stub.lookups == 2
@@ -0,0 +1,79 @@
+"""The SSE endpoint streams the reply and saves each turn exactly once.
+
+Runs against the API and stand-ins started by conftest.py:
+
+    python -m pytest test_streaming.py
+"""
+import json
+import time
+
+import httpx
+
+from fake_openai import REPLY
+
+
+def stream_url(client):
+    conversation_id = client.post("/conversations").json()["id"]
+    return conversation_id, f"/conversations/{conversation_id}/messages/stream"
+
+
+def stored_messages(stack, conversation_id):
+    response = httpx.get(
+        f"{stack.postgrest}/rest/v1/messages",
+        params={"select": "role,content", "conversation_id": f"eq.{conversation_id}", "order": "id"}
+    )
+    return [(row["role"], row["content"]) for row in response.json()]
+
+
+def in_flight(client):
+    for line in client.get("/metrics").text.splitlines():
+        if line.startswith("tutor_llm_in_flight "):
+            return float(line.split()[1])
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.05)
+
+
+def test_stream_sends_tokens_then_done_and_saves_both_turns(stack):
+    with httpx.Client(base_url=stack.api, timeout=30) as client:
+        conversation_id, url = stream_url(client)
+        events = []
+        with client.stream("POST", url, json={"message": "What is a prime?"}) as response:
+            assert response.status_code == 200
+            assert response.headers["content-type"].startswith("text/event-stream")
+            for line in response.iter_lines():
+                if line.startswith("data: "):
+                    events.append(line[len("data: "):])
+
+    assert events[-1] == "[DONE]"
+    tokens = [json.loads(event)["token"] for event in events[:-1]]
+    assert len(tokens) > 1 and "".join(tokens) == REPLY
+    assert stored_messages(stack, conversation_id) == [("user", "What is a prime?"), ("assistant", REPLY)]
+
+
+def test_disconnect_mid_stream_saves_the_question_and_frees_the_slot(stack):
+    with httpx.Client(base_url=stack.api, timeout=30) as client:
+        conversation_id, url = stream_url(client)
+        with client.stream("POST", url, json={"message": "Leaving early"}) as response:
+            next(line for line in response.iter_lines() if line.startswith("data: "))
+
+        wait_for(lambda: stored_messages(stack, conversation_id))
+        wait_for(lambda: in_flight(client) == 0)
+    time.sleep(0.3)
+    assert stored_messages(stack, conversation_id) == [("user", "Leaving early")]
+
+
+def test_disconnect_before_the_body_saves_the_question_and_frees_the_slot(stack):
+    with httpx.Client(base_url=stack.api, timeout=30) as client:
+        conversation_id, url = stream_url(client)
+        with client.stream("POST", url, json={"message": "Never read"}):
+            pass
+
+        wait_for(lambda: stored_messages(stack, conversation_id))
+        wait_for(lambda: in_flight(client) == 0)
+    time.sleep(0.3)
+    assert stored_messages(stack, conversation_id) == [("user", "Never read")]
@@ -0,0 +1,223 @@
+import asyncio
+import json
+import os
+from datetime import datetime
+
+from database import table, execute
+from llm_gateway import llm_gateway
+from metrics import registry
+
+TITLE_JOBS_ENABLED = os.getenv("TITLE_JOBS_ENABLED", "true").lower() == "true"
+# Titles are generated once a conversation has this many student messages
+TITLE_AFTER_TURNS = int(os.getenv("TITLE_AFTER_TURNS", "3"))
+TITLE_JOB_WORKERS = int(os.getenv("TITLE_JOB_WORKERS", "1"))
+# Conversations titled by a single LLM call, and how long a worker waits to fill a batch
+TITLE_JOB_BATCH_SIZE = int(os.getenv("TITLE_JOB_BATCH_SIZE", "8"))
+TITLE_JOB_BATCH_WINDOW = float(os.getenv("TITLE_JOB_BATCH_WINDOW", "2.0"))
+TITLE_JOB_MAX_ATTEMPTS = int(os.getenv("TITLE_JOB_MAX_ATTEMPTS", "3"))
+# Also write a summary; needs the conversations.summary column (see README)
+TITLE_JOBS_SUMMARY = os.getenv("TITLE_JOBS_SUMMARY", "false").lower() == "true"
+# Optional table that keeps queued jobs across restarts; empty keeps them in memory only
+TITLE_JOBS_TABLE = os.getenv("TITLE_JOBS_TABLE", "")
+
+MODEL = "gpt-3.5-turbo"
+# Only the start of a conversation is sent, trimmed, to keep the batched prompt small
+_MESSAGES_PER_CONVERSATION = 6
+_MAX_MESSAGE_CHARS = 500
+_TOKENS_PER_CONVERSATION = 80
+_RETRY_DELAY = 30.0
+
+_SYSTEM_PROMPT = (
+    "You write titles and summaries for tutoring conversations. For each conversation, write a "
+    "title of at most six words and a one or two sentence summary of what the student is working on. "
+    'Reply with only a JSON object mapping each conversation id to {"title": ..., "summary": ...}.'
+)
+_TITLE_ONLY_PROMPT = (
+    "You write titles for tutoring conversations. For each conversation, write a title of at most six words. "
+    'Reply with only a JSON object mapping each conversation id to {"title": ...}.'
+)
+_TOKENS_PER_TITLE = 20
+
+
+class TitleJobs:
+    """Background workers that title and summarize conversations in batches.
+
+    Requests only enqueue a conversation id, so title generation never adds
+    latency to a turn. Workers collect up to `TITLE_JOB_BATCH_SIZE` queued
+    conversations and title them with one LLM call through the gateway.
+    With TITLE_JOBS_TABLE set, queued jobs are also recorded in Supabase and
+    reloaded at startup, so a restart does not lose them.
+    """
+
+    def __init__(self):
+        self._queue = None
+        self._workers = []
+        self._queued = set()
+        # Keeps fire-and-forget bookkeeping tasks alive until they finish
+        self._tasks = set()
+        self.completed = 0
+        self.failed = 0
+        # Update errors already printed; a schema problem fails every update the same way
+        self._logged_errors = set()
+
+    async def start(self):
+        if not TITLE_JOBS_ENABLED or self._workers:
+            return
+        self._queue = asyncio.Queue()
+        if TITLE_JOBS_TABLE:
+            try:
+                jobs = await execute(table(TITLE_JOBS_TABLE).select("conversation_id, attempts"))
+                for job in jobs.data:
+                    self._put(job["conversation_id"], job["attempts"])
+            except Exception as e:
+                print(f"Loading queued title jobs failed: {e}")
+        self._workers = [asyncio.create_task(self._work()) for _ in range(TITLE_JOB_WORKERS)]
+
+    async def stop(self):
+        """Stop the workers. Queued jobs survive only when TITLE_JOBS_TABLE is set."""
+        for task in self._workers + list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._workers, *self._tasks, return_exceptions=True)
+        self._workers = []
+
+    def on_turn(self, conversation_id, user_turns):
+        """Queue a conversation once it reaches TITLE_AFTER_TURNS student messages."""
+        if self._workers and user_turns == TITLE_AFTER_TURNS:
+            self.enqueue(conversation_id)
+
+    def enqueue(self, conversation_id, attempts=0):
+        if not self._put(conversation_id, attempts):
+            return
+        if TITLE_JOBS_TABLE:
+            self._spawn(self._record(conversation_id, attempts))
+
+    def _put(self, conversation_id, attempts):
+        if conversation_id in self._queued:
+            return False
+        self._queued.add(conversation_id)
+        self._queue.put_nowait((conversation_id, attempts))
+        return True
+
+    def _spawn(self, coroutine):
+        task = asyncio.create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _record(self, conversation_id, attempts):
+        try:
+            await execute(table(TITLE_JOBS_TABLE).upsert({
+                "conversation_id": conversation_id,
+                "attempts": attempts,
+                "created_at": datetime.utcnow().isoformat()
+            }, on_conflict="conversation_id"))
+        except Exception as e:
+            print(f"Recording title job for conversation {conversation_id} failed: {e}")
+
+    async def _retry_later(self, conversation_id, attempts):
+        await asyncio.sleep(_RETRY_DELAY)
+        self.enqueue(conversation_id, attempts)
+
+    async def _work(self):
+        while True:
+            batch = [await self._queue.get()]
+            # Let more conversations reach their title turn so they share the call
+            await asyncio.sleep(TITLE_JOB_BATCH_WINDOW)
+            while len(batch) < TITLE_JOB_BATCH_SIZE and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            for conversation_id, _ in batch:
+                self._queued.discard(conversation_id)
+            try:
+                titled = await self._run(dict(batch))
+            except Exception as e:
+                print(f"Title job for {len(batch)} conversations failed: {e}")
+                titled = set()
+            for conversation_id, attempts in batch:
+                if conversation_id in titled:
+                    continue
+                if attempts + 1 < TITLE_JOB_MAX_ATTEMPTS:
+                    self._spawn(self._retry_later(conversation_id, attempts + 1))
+                else:
+                    self.failed += 1
+                    await self._forget([conversation_id])
+
+    async def _run(self, batch):
+        """Title one batch of conversations and return the ids that were updated."""
+        ids = list(batch)
+        # One small query per conversation so a long one cannot crowd out the others
+        results = await asyncio.gather(*(
+            execute(
+                table("messages").select("role, content").eq("conversation_id", conversation_id)
+                .order("id").limit(_MESSAGES_PER_CONVERSATION)
+            )
+            for conversation_id in ids
+        ))
+        transcripts = []
+        for conversation_id, result in zip(ids, results):
+            lines = [f"{m['role']}: {m['content'][:_MAX_MESSAGE_CHARS]}" for m in result.data]
+            transcripts.append(f"Conversation {conversation_id}:\n" + "\n".join(lines))
+
+        response = await llm_gateway.create(
+            "title-jobs",
+            model=MODEL,
+            max_tokens=(_TOKENS_PER_CONVERSATION if TITLE_JOBS_SUMMARY else _TOKENS_PER_TITLE) * len(ids),
+            messages=[
+                {"role": "system", "content": _SYSTEM_PROMPT if TITLE_JOBS_SUMMARY else _TITLE_ONLY_PROMPT},
+                {"role": "user", "content": "\n\n".join(transcripts)}
+            ]
+        )
+        generated = _parse(response.choices[0].message.content)
+
+        updates = {}
+        for conversation_id in ids:
+            entry = generated.get(str(conversation_id))
+            if isinstance(entry, dict) and entry.get("title"):
+                updates[conversation_id] = {"title": str(entry["title"]).strip()[:200]}
+                if TITLE_JOBS_SUMMARY:
+                    updates[conversation_id]["summary"] = str(entry.get("summary", "")).strip()
+        # PostgREST has no multi-row update with different values, so these run concurrently
+        results = await asyncio.gather(*(
+            execute(table("conversations").update(values).eq("id", conversation_id))
+            for conversation_id, values in updates.items()
+        ), return_exceptions=True)
+        updated = []
+        for conversation_id, result in zip(updates, results):
+            if not isinstance(result, Exception):
+                updated.append(conversation_id)
+                continue
+            # Another LLM call would not fix the update, so the job is dropped rather than retried
+            self.failed += 1
+            if str(result) not in self._logged_errors:
+                self._logged_errors.add(str(result))
+                print(f"Saving the title of conversation {conversation_id} failed: {result}")
+        self.completed += len(updated)
+        await self._forget(list(updates))
+        return set(updates)
+
+    async def _forget(self, conversation_ids):
+        if TITLE_JOBS_TABLE and conversation_ids:
+            try:
+                await execute(table(TITLE_JOBS_TABLE).delete().in_("conversation_id", conversation_ids))
+            except Exception as e:
+                print(f"Removing finished title jobs failed: {e}")
+
+    def queue_depth(self):
+        return self._queue.qsize() if self._queue else 0
+
+
+def _parse(content):
+    """Pull the JSON object out of a reply, tolerating text around it."""
+    start, end = content.find("{"), content.rfind("}")
+    if start == -1 or end < start:
+        return {}
+    try:
+        parsed = json.loads(content[start:end + 1])
+    except ValueError:
+        return {}
+    return parsed if isinstance(parsed, dict) else {}
+
+
+title_jobs = TitleJobs()
+
+registry.gauge("tutor_title_jobs_queue_depth", "Conversations waiting for a title.", title_jobs.queue_depth)
+registry.counter("tutor_title_jobs_completed_total", "Conversations titled.", lambda: title_jobs.completed)
+registry.counter("tutor_title_jobs_failed_total", "Conversations given up on: TITLE_JOB_MAX_ATTEMPTS failed LLM calls, or a failed update.", lambda: title_jobs.failed)
@@ -0,0 +1,53 @@
+"""Benchmark inbox scans against the local Gmail stand-in.
+
+    uvicorn fake_gmail:app --port 9100
+    GMAIL_API_ENDPOINT=http://localhost:9100/ python bench_gmail.py --messages 100
+
+Compares one messages().get() per id (the old loop) with batch requests, for
+full messages and for header-only metadata fetches.
+"""
+import argparse
+import time
+
+from google.auth.credentials import AnonymousCredentials
+from googleapiclient.discovery import build
+
+import gmail_api
+from gmail_api import get_messages, list_message_ids
+
+
+def serial(service, message_ids):
+    return [service.users().messages().get(userId='me', id=message_id).execute() for message_id in message_ids]
+
+
+def measure(name, fetch, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        messages = fetch()
+        timings.append(time.perf_counter() - start)
+    best = min(timings)
+    print(f"{name:<24} {best * 1000:8.1f} ms   ({len(messages)} messages)")
+    return best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=100)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    if not gmail_api.GMAIL_API_ENDPOINT:
+        parser.error("set GMAIL_API_ENDPOINT to the fake Gmail server")
+    service = build('gmail', 'v1', credentials=AnonymousCredentials(),
+                    client_options={'api_endpoint': gmail_api.GMAIL_API_ENDPOINT})
+    message_ids = list_message_ids(service, args.messages, labelIds=['INBOX'])
+
+    baseline = measure("serial get()", lambda: serial(service, message_ids), args.runs)
+    batched = measure("batch, full", lambda: get_messages(service, message_ids), args.runs)
+    metadata = measure(
+        "batch, metadata",
+        lambda: get_messages(service, message_ids, format="metadata", metadata_headers=["From", "Subject"]),
+        args.runs
+    )
+    print(f"speedup: {baseline / batched:.1f}x full, {baseline / metadata:.1f}x metadata")
@@ -0,0 +1,108 @@
+"""Compare email classification on the OpenAI path and the local Ollama path.
+
+    uvicorn fake_ollama:app --port 11434          # or a real `ollama serve`
+    OPENAI_BASE_URL=http://localhost:9000/v1 python bench_local_llm.py --emails 60
+
+Every email of a generated fixture inbox is classified with the single-email
+prompt, `--concurrency` at a time as in parallel mode, by:
+
+  openai        ChatOpenAI, full bodies (classify_email)
+  ollama-old    a new ChatOllama per email, full bodies, no warm-up (the old classify_email_ollama)
+  ollama        LocalClassifier: one client, bounded requests, cut bodies, warmed up first
+
+and reports throughput, latency, accuracy against the fixture labels and
+agreement with the OpenAI labels. The model is unloaded before the old path
+runs, so it pays the cold start it used to.
+"""
+import argparse
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import ollama
+from langchain_core.messages import HumanMessage
+from langchain_ollama import ChatOllama
+from langchain_openai import ChatOpenAI
+
+from local_llm import OLLAMA_BASE_URL, OLLAMA_MODEL, LocalClassifier, classification_prompt, parse_label
+
+PARAGRAPH = (
+    "We reviewed the numbers from last quarter and there are a few things worth "
+    "discussing before the planning meeting, in particular the hiring plan. "
+)
+
+
+def fixture_inbox(count):
+    """Emails with the label they should get: long newsletters, short personal mail, long work threads, receipts."""
+    emails = []
+    for i in range(count):
+        kind = i % 4
+        if kind == 0:
+            body = "Save big on everything this week. " * 400 + f"Unsubscribe: https://news{i % 7}.example.com/u"
+            email = {'subject': f"Weekly deals #{i}", 'sender': f"Deals <deals@news{i % 7}.example.com>", 'body': body}
+            label = 'spam/marketing'
+        elif kind == 1:
+            email = {'subject': f"Lunch on day {i}?", 'sender': f"Friend {i} <friend{i}@example.org>",
+                     'body': f"Hi, are you free for lunch on day {i}? Let me know."}
+            label = 'important'
+        elif kind == 2:
+            email = {'subject': f"Re: Q{i % 4 + 1} planning", 'sender': "Manager <manager@mycompany.com>",
+                     'body': PARAGRAPH * 80}
+            label = 'important'
+        else:
+            email = {'subject': f"Your order #{1000 + i} has shipped", 'sender': "Store <orders@store.example.com>",
+                     'body': "".join(f"Item {n}: 1 x ${n}.00\n" for n in range(60))}
+            label = 'important'
+        emails.append({**email, 'id': str(i), 'expected': label})
+    return emails
+
+
+def run(name, classify, emails, concurrency):
+    def timed(email):
+        started = time.perf_counter()
+        label = classify(email)
+        return label, time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(timed, emails))
+    elapsed = time.perf_counter() - started
+    labels = [label for label, _ in results]
+    latencies = sorted(latency for _, latency in results)
+    accuracy = sum(label == email['expected'] for label, email in zip(labels, emails)) / len(emails)
+    print(f"{name:<11} {len(emails) / elapsed:7.1f}/s {elapsed:7.2f}s "
+          f"{statistics.median(latencies) * 1000:7.0f}ms {latencies[int(len(latencies) * 0.95) - 1] * 1000:7.0f}ms "
+          f"{accuracy:8.0%}", end="")
+    return labels
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--emails", type=int, default=60)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--openai-model", default="gpt-3.5-turbo")
+    args = parser.parse_args()
+
+    emails = fixture_inbox(args.emails)
+    openai_llm = ChatOpenAI(model=args.openai_model, temperature=0)
+
+    def classify_openai(email):
+        return parse_label(openai_llm.invoke([HumanMessage(content=classification_prompt(email))]).content)
+
+    def classify_ollama_old(email):
+        llm = ChatOllama(model=OLLAMA_MODEL, base_url=OLLAMA_BASE_URL)
+        return parse_label(llm.invoke([HumanMessage(content=classification_prompt(email))]).content)
+
+    print(f"{'path':<11} {'emails':>9} {'total':>8} {'p50':>9} {'p95':>9} {'accuracy':>8}  agreement")
+    reference = run("openai", classify_openai, emails, args.concurrency)
+    print()
+
+    ollama.Client(host=OLLAMA_BASE_URL).chat(model=OLLAMA_MODEL, messages=[], keep_alive=0)
+    labels = run("ollama-old", classify_ollama_old, emails, args.concurrency)
+    print(f"  {sum(a == b for a, b in zip(labels, reference)) / len(emails):8.0%}")
+
+    local = LocalClassifier()
+    ollama.Client(host=OLLAMA_BASE_URL).chat(model=OLLAMA_MODEL, messages=[], keep_alive=0)
+    print(f"(warm-up {local.warm_up():.2f}s at startup)")
+    labels = run("ollama", local.classify, emails, args.concurrency)
+    print(f"  {sum(a == b for a, b in zip(labels, reference)) / len(emails):8.0%}")
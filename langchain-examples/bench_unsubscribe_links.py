@@ -0,0 +1,157 @@
+"""Benchmark unsubscribe-link extraction against the old BeautifulSoup parse.
+
+    pip install -r requirements-bench.txt
+    python bench_unsubscribe_links.py
+    python bench_unsubscribe_links.py --samples path/to/html/
+
+The built-in corpus is generated (synthetic, not real mail), modeled on common newsletter layouts: a
+table-based campaign template, a long-form newsletter, a product-grid promo
+with heavy inline CSS, an Outlook-style message with conditional comments
+and unquoted uppercase attributes, and a receipt with no unsubscribe link.
+Each layout, and a few anchors whose keyword is split by inline tags or
+written as entities, is checked for the same links as the old parser before
+timing.
+`--samples` runs on a directory of real (anonymized) email bodies instead,
+one .html file each.
+"""
+import argparse
+import os
+import time
+
+from bs4 import BeautifulSoup
+
+from unsubscribe import LINK_PATTERNS, extract_unsubscribe_links
+
+
+def old_extract(html_content):
+    """The previous implementation: a full html.parser tree per email."""
+    soup = BeautifulSoup(html_content, 'html.parser')
+    links = []
+    for link in soup.find_all('a'):
+        href = link.get('href', '')
+        text = link.get_text().lower()
+        if any(pattern in text or pattern in href.lower() for pattern in LINK_PATTERNS):
+            links.append({'text': text, 'url': href})
+    return links
+
+
+def campaign(i):
+    rows = "".join(
+        f'<tr><td style="padding:12px 24px;font-family:Helvetica,Arial;color:#333">'
+        f'<h2 style="margin:0">Story {n}</h2><p>Lorem ipsum dolor sit amet, consectetur adipiscing elit {n}.</p>'
+        f'<a href="https://click.list{i}.example.com/track?u=abc&amp;id={n}&amp;e=xyz" style="color:#0a7">Read more</a></td></tr>'
+        for n in range(60)
+    )
+    footer = (
+        f'<tr><td class="footer"><em>Copyright © List {i}</em><br>'
+        f'<a href="https://list{i}.example.com/unsubscribe?u=abc&amp;id=1">unsubscribe from this list</a> '
+        f'<a href="https://list{i}.example.com/profile?u=abc">update subscription preferences</a></td></tr>'
+    )
+    return f'<!DOCTYPE html><html><head><style>td{{font-size:14px}}</style></head><body><table width="600">{rows}{footer}</table></body></html>'
+
+
+def longform(i):
+    paragraphs = "".join(
+        f"<p>Paragraph {n} of the essay, with a <a href='https://example.org/ref/{n}'>reference</a> "
+        f"and some <strong>emphasis</strong> &amp; entities &mdash; to parse.</p>"
+        for n in range(150)
+    )
+    return (
+        f"<html><body><article><h1>Issue #{i}</h1>{paragraphs}</article>"
+        f"<footer><a href='https://writer{i}.example.com/action/disable_email?token=t{i}'>Unsubscribe</a>"
+        f"</footer></body></html>"
+    )
+
+
+def promo(i):
+    style = "font-family:Arial;font-size:13px;line-height:18px;color:#222;text-decoration:none;" * 3
+    products = "".join(
+        f'<td style="{style}"><a href="https://shop{i}.example.com/p/{n}?utm_source=email" style="{style}">'
+        f'<img src="https://cdn.example.com/{n}.jpg" alt="Product {n}" width="180"><span style="{style}">Product {n}</span>'
+        f'<span style="{style}">$ {n}.99</span></a></td>'
+        + ('</tr><tr>' if n % 3 == 2 else '')
+        for n in range(90)
+    )
+    return (
+        f'<html><body><table><tr>{products}</tr></table>'
+        f'<p style="{style}">You are receiving this because you signed up. '
+        f'<a href="https://shop{i}.example.com/email/preferences">Manage preferences</a> | '
+        f'<a href="https://shop{i}.example.com/email/optout">Opt-out</a></p></body></html>'
+    )
+
+
+def outlook(i):
+    blocks = "".join(
+        f'<!--[if mso]><table><tr><td width=600><![endif]--><DIV class=block{n}>'
+        f'<P>Update {n}: <A HREF=https://corp{i}.example.com/news/{n}>details</A></P></DIV>'
+        f'<!--[if mso]></td></tr></table><![endif]-->'
+        for n in range(120)
+    )
+    return (
+        f'<HTML><BODY>{blocks}<P><A HREF=https://corp{i}.example.com/subscription/manage?id={i}>'
+        f'<FONT color=#999>Manage your subscription</FONT></A></P></BODY></HTML>'
+    )
+
+
+def receipt(i):
+    lines = "".join(f"<tr><td>Item {n}</td><td>1</td><td>${n}.00</td></tr>" for n in range(200))
+    return f'<html><body><h1>Order #{i}</h1><table>{lines}</table><a href="https://store.example.com/orders/{i}">View order</a></body></html>'
+
+
+# The keyword only appears once tags are stripped or entities decoded
+SPLIT_ANCHORS = [
+    '<p><a href="https://list.example.com/u?id=1">Un<b>subscribe</b></a></p>',
+    '<p><A HREF=https://list.example.com/x?id=2><span>Opt</span>-<span>out</span></A></p>',
+    '<p><a href="https://list.example.com/y?id=3">&#85;nsubscribe here</a></p>',
+    "<p><a href='https://list.example.com/&#117;nsubscribe'>Leave</a></p>",
+]
+
+LAYOUTS = {"campaign": campaign, "longform": longform, "promo": promo, "outlook": outlook, "receipt": receipt}
+
+
+def load_samples(directory):
+    corpus = []
+    for name in sorted(os.listdir(directory)):
+        if name.endswith((".html", ".htm")):
+            with open(os.path.join(directory, name), encoding="utf-8", errors="replace") as f:
+                corpus.append(f.read())
+    if not corpus:
+        raise SystemExit(f"no .html files in {directory}")
+    return corpus
+
+
+def measure(fn, corpus, runs):
+    best = float("inf")
+    for _ in range(runs):
+        start = time.perf_counter()
+        for body in corpus:
+            fn(body)
+        best = min(best, time.perf_counter() - start)
+    return best * 1000 / len(corpus)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--emails", type=int, default=20, help="emails per layout")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--samples", help="directory of .html email bodies to use instead of the generated corpus")
+    args = parser.parse_args()
+
+    if args.samples:
+        corpora = {"samples": load_samples(args.samples)}
+    else:
+        corpora = {name: [layout(i) for i in range(args.emails)] for name, layout in LAYOUTS.items()}
+
+    for body in SPLIT_ANCHORS:
+        assert extract_unsubscribe_links(body) == old_extract(body) != [], body
+
+    header = "<https://list.example.com/unsubscribe?u=1>, <mailto:unsubscribe@list.example.com>"
+    print(f"{'layout':<10} {'size':>8} {'bs4':>9} {'regex':>9} {'header':>9}  speedup")
+    for name, corpus in corpora.items():
+        for body in corpus:
+            assert extract_unsubscribe_links(body) == old_extract(body), name
+        old = measure(old_extract, corpus, args.runs)
+        new = measure(extract_unsubscribe_links, corpus, args.runs)
+        with_header = measure(lambda body: extract_unsubscribe_links(body, header), corpus, args.runs)
+        size = sum(map(len, corpus)) // len(corpus) // 1024
+        print(f"{name:<10} {size:>6}KB {old:>7.2f}ms {new:>7.3f}ms {with_header:>7.4f}ms  {old / new:6.0f}x")
@@ -0,0 +1,100 @@
+"""Persistent cache of email classifications, so re-runs skip the LLM."""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+CLASSIFICATION_CACHE_FILE = os.getenv("CLASSIFICATION_CACHE_FILE", "classification_cache.sqlite3")
+# Entries older than this are classified again; 0 keeps them until evicted
+CLASSIFICATION_CACHE_TTL_DAYS = float(os.getenv("CLASSIFICATION_CACHE_TTL_DAYS", "30"))
+# Least recently used entries are dropped beyond this many
+CLASSIFICATION_CACHE_MAX_ENTRIES = int(os.getenv("CLASSIFICATION_CACHE_MAX_ENTRIES", "50000"))
+
+# Evicting on every put would scan the table each time
+_EVICT_EVERY = 100
+
+
+def content_hash(email):
+    """Hash of what the classifier sees, so an edited draft or resent message is classified again."""
+    digest = hashlib.sha256()
+    for field in ('subject', 'sender', 'body'):
+        digest.update(email.get(field, '').encode())
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class ClassificationCache:
+    """SQLite cache keyed by (message id, content hash, classifier version).
+
+    `version` names the model and prompt; changing either misses every old
+    entry, which then ages out through the TTL and LRU eviction.
+    """
+
+    def __init__(self, version, path=CLASSIFICATION_CACHE_FILE, ttl_days=CLASSIFICATION_CACHE_TTL_DAYS,
+                 max_entries=CLASSIFICATION_CACHE_MAX_ENTRIES):
+        self.version = version
+        self.ttl = ttl_days * 86400
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS classifications (
+                message_id TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                version TEXT NOT NULL,
+                classification TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                used_at REAL NOT NULL,
+                PRIMARY KEY (message_id, content_hash, version)
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS classifications_used_at ON classifications (used_at)")
+
+    def get(self, email):
+        now = time.time()
+        key = (email['id'], content_hash(email), self.version)
+        with self._lock:
+            row = self._db.execute(
+                "SELECT classification, created_at FROM classifications"
+                " WHERE message_id = ? AND content_hash = ? AND version = ?",
+                key
+            ).fetchone()
+            if row is None or (self.ttl and now - row[1] > self.ttl):
+                self.misses += 1
+                return None
+            self._db.execute(
+                "UPDATE classifications SET used_at = ? WHERE message_id = ? AND content_hash = ? AND version = ?",
+                (now, *key)
+            )
+            self.hits += 1
+            return row[0]
+
+    def put(self, email, classification):
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO classifications VALUES (?, ?, ?, ?, ?, ?)",
+                (email['id'], content_hash(email), self.version, classification, now, now)
+            )
+            self._puts += 1
+            if self._puts % _EVICT_EVERY == 0:
+                self._evict(now)
+
+    def evict(self):
+        """Drop expired entries and trim the cache to `max_entries`."""
+        with self._lock:
+            self._evict(time.time())
+
+    def _evict(self, now):
+        if self.ttl:
+            self._db.execute("DELETE FROM classifications WHERE created_at < ?", (now - self.ttl,))
+        self._db.execute(
+            "DELETE FROM classifications WHERE rowid IN ("
+            " SELECT rowid FROM classifications ORDER BY used_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        )
@@ -1,24 +1,42 @@
 from typing import Dict, List, Annotated, TypedDict
+import operator
+import threading
+from collections import Counter
 from langgraph.graph import Graph, StateGraph, END
+from langgraph.types import Send
 from langgraph.prebuilt import ToolNode
 from langchain_core.messages import HumanMessage
 from langchain_openai import ChatOpenAI
+from openai.types.chat import ChatCompletion
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
 from googleapiclient.discovery import build
+from google_auth_httplib2 import AuthorizedHttp
+import httplib2
 import os
 import pickle
-import base64
+import time
+import asyncio
 from datetime import datetime
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException
 import uvicorn
 import re
-from bs4 import BeautifulSoup
-import requests
-from urllib.parse import urlparse
-# from langchain_community.chat_models import ChatOllama
-from langchain_ollama import ChatOllama
+import json
+import base64
+import google.auth.credentials
+from google.auth.credentials import AnonymousCredentials
+from gmail_api import (
+    GMAIL_API_ENDPOINT, HistoryExpired, get_messages, list_message_ids, modify_messages,
+    get_history_id, list_history_message_ids, load_sync_state, save_sync_state, watch_mailbox
+)
+from classification_cache import ClassificationCache
+from pre_classifier import PreClassifier
+from unsubscribe import extract_unsubscribe_links, unsubscribe_all
+from gmail_message import GmailMessage
+from local_llm import LocalClassifier, classification_prompt, parse_label
+from inbox_watcher import InboxWatcher, WATCH_ENABLED, PUBSUB_VERIFICATION_TOKEN
 
 # Define the state
 class EmailState(TypedDict):
@@ -27,21 +45,136 @@ class EmailState(TypedDict):
     current_email: Dict
     classification: str
     action_taken: bool
+    history_id: str
+    classifications: Dict[str, str]
+    sync: str
+
+# In parallel mode each email is handled by its own task, whose results are appended
+class ParallelEmailState(EmailState):
+    processed_emails: Annotated[List[Dict], operator.add]
 
 # Gmail API scopes
 SCOPES = ['https://www.googleapis.com/auth/gmail.modify']
 
-app = FastAPI()
+# How many INBOX messages a full sync looks at
+INBOX_MAX_RESULTS = int(os.getenv("INBOX_MAX_RESULTS", "1"))
+# "full" lists the latest INBOX_MAX_RESULTS emails every run; "incremental" only
+# fetches mail added since the last run, so a second run may find nothing
+INBOX_SYNC_MODES = ("full", "incremental")
+INBOX_SYNC = os.getenv("INBOX_SYNC", "full")
+# Bump when the classification prompt changes so cached results are not reused
+CLASSIFY_PROMPT_VERSION = "1"
+# Emails classified per LLM call, and a rough cap on the prompt size of one call; 1 disables batching
+CLASSIFY_BATCH_SIZE = int(os.getenv("CLASSIFY_BATCH_SIZE", "20"))
+CLASSIFY_BATCH_TOKEN_BUDGET = int(os.getenv("CLASSIFY_BATCH_TOKEN_BUDGET", "6000"))
+LABELS = ('spam/marketing', 'important')
+# Every email takes four steps around the graph loop; LangGraph's default of 25 stops at six emails
+GRAPH_RECURSION_LIMIT = 100000
+# Emails classified and acted on at once; 1 keeps the one-at-a-time loop
+PROCESS_CONCURRENCY = int(os.getenv("PROCESS_CONCURRENCY", "1"))
+SPAM_LABEL = 'spam-ai-bot'
+# "openai" or "ollama": which model classify_email calls when rules and cache don't decide
+CLASSIFY_BACKEND = os.getenv("CLASSIFY_BACKEND", "openai")
+# A label missing from the cache triggers at most one labels().list() per interval
+LABEL_REFRESH_INTERVAL = 60
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Built once per process: token, Gmail client, LLM client and compiled graph are reused by every request
+    app.state.processor = EmailProcessor()
+    app.state.watcher = InboxWatcher(app.state.processor) if WATCH_ENABLED else None
+    if app.state.watcher:
+        await app.state.watcher.start()
+    yield
+    if app.state.watcher:
+        await app.state.watcher.stop()
+
+app = FastAPI(lifespan=lifespan)
+
+def _warm_openai_models():
+    """Build the response models before threads use them.
+
+    When the first few responses are parsed concurrently, some come back as
+    empty models and langchain fails with KeyError: 'choices'.
+    """
+    ChatCompletion.model_validate({
+        "id": "warm-up", "object": "chat.completion", "created": 0, "model": "warm-up",
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": ""}, "finish_reason": "stop"}]
+    })
+
+class SharedCredentials(google.auth.credentials.Credentials):
+    """The credentials every thread's AuthorizedHttp authorizes with.
+
+    AuthorizedHttp (and batch requests) refresh an expired token before a
+    request and again after a 401. Both go through one lock, so a token is
+    refreshed once however many threads notice, and `on_refresh` saves the
+    new one.
+    """
+
+    def __init__(self, credentials, lock, on_refresh):
+        super().__init__()
+        self.credentials = credentials
+        self._lock = lock
+        self._on_refresh = on_refresh
+
+    @property
+    def valid(self):
+        return self.credentials.valid
+
+    @property
+    def expired(self):
+        return self.credentials.expired
+
+    def apply(self, headers, token=None):
+        self.credentials.apply(headers, token=token)
+
+    def before_request(self, request, method, url, headers):
+        if not self.credentials.valid:
+            self.refresh(request)
+        self.credentials.before_request(request, method, url, headers)
+
+    def refresh(self, request):
+        stale_token = self.credentials.token
+        with self._lock:
+            if self.credentials.token != stale_token:
+                # Another thread refreshed it while this one waited
+                return
+            self.credentials.refresh(request)
+            self._on_refresh()
 
 class EmailProcessor:
     def __init__(self):
         # self.llm = ChatOpenAI(model="gpt-3.5-turbo")
         self.llm = ChatOpenAI(model="tinyllama")
+        self.local_llm = LocalClassifier() if CLASSIFY_BACKEND == "ollama" else None
+        model_name = self.local_llm.model_name if self.local_llm else self.llm.model_name
+        self.classification_cache = ClassificationCache(f"{model_name}:{CLASSIFY_PROMPT_VERSION}")
+        self.pre_classifier = PreClassifier()
+        # How each email of the last run was classified: rules, cache or llm
+        self.classified_by = Counter()
+        self._count_lock = threading.Lock()
+        self._local = threading.local()
+        self._label_ids = {}
+        self._labels_refreshed_at = None
+        self._credentials_lock = threading.Lock()
+        # Held by callers for a whole run; two incremental runs at once would process the same mail
+        self.run_lock = threading.Lock()
+        if PROCESS_CONCURRENCY > 1:
+            _warm_openai_models()
+        if self.local_llm:
+            print(f"DEBUG: [Ollama] {self.local_llm.model_name} loaded in {self.local_llm.warm_up():.2f}s")
         self.service = self._get_gmail_service()
+        self.shared_credentials = SharedCredentials(self.credentials, self._credentials_lock, self._save_credentials)
         self.graph = self._build_graph()
     
     def _get_gmail_service(self):
         """Get Gmail API service."""
+        if GMAIL_API_ENDPOINT:
+            # Local stand-in, no OAuth needed
+            self.credentials = AnonymousCredentials()
+            return build('gmail', 'v1', credentials=self.credentials, static_discovery=True,
+                         client_options={'api_endpoint': GMAIL_API_ENDPOINT})
+
         creds = None
         if os.path.exists('token.pickle'):
             with open('token.pickle', 'rb') as token:
@@ -57,14 +190,127 @@ class EmailProcessor:
             with open('token.pickle', 'wb') as token:
                 pickle.dump(creds, token)
 
-        return build('gmail', 'v1', credentials=creds)
+        self.credentials = creds
+        # The discovery document bundled with the client library, never fetched over the network
+        return build('gmail', 'v1', credentials=creds, static_discovery=True)
+
+    def _save_credentials(self):
+        with open('token.pickle', 'wb') as token:
+            pickle.dump(self.credentials, token)
+
+    def _ensure_credentials(self):
+        """Refresh an expired token before a run fans out; later expiries are handled by SharedCredentials."""
+        if not self.credentials.valid and getattr(self.credentials, 'refresh_token', None):
+            self.shared_credentials.refresh(Request())
+
+    def _http(self):
+        """An authorized connection for the calling thread; httplib2 is not thread-safe."""
+        if not hasattr(self._local, 'http'):
+            self._local.http = AuthorizedHttp(self.shared_credentials, http=httplib2.Http())
+        return self._local.http
+
+    def _email_from_message(self, msg):
+        """Turn a Gmail message resource into the email used by the graph.
+
+        Bodies are looked up anywhere in the MIME tree but only decoded when a
+        node reads them, so emails the rules label from headers are never decoded.
+        """
+        return GmailMessage(msg)
+
+    def _inbox_message_ids(self, sync):
+        """Return (message ids to process, historyId to store once they are done).
+
+        Incremental sync reads only the history since the stored historyId, so
+        a run costs O(new mail). Without a stored id, or once Gmail has expired
+        that history, it falls back to listing INBOX.
+        """
+        if sync == "incremental":
+            start_history_id = load_sync_state().get('historyId')
+            if start_history_id:
+                try:
+                    return list_history_message_ids(self.service, start_history_id, http=self._http())
+                except HistoryExpired:
+                    print(f"DEBUG: History from {start_history_id} expired, doing a full sync")
+        # Read the historyId first so mail arriving during the listing is picked up next time
+        history_id = get_history_id(self.service, http=self._http())
+        return list_message_ids(self.service, INBOX_MAX_RESULTS, http=self._http(), labelIds=['INBOX']), history_id
+
+    def _classification_batches(self, emails):
+        """Group emails into batches of at most CLASSIFY_BATCH_SIZE within the token budget.
+
+        An email too large for the budget on its own is left out, so classify_email
+        handles it with a call of its own.
+        """
+        batch, tokens = [], 0
+        for email in emails:
+            # ~4 characters per token is close enough for a budget
+            size = (len(email['subject']) + len(email['sender']) + len(email['body'])) // 4 + 20
+            if size > CLASSIFY_BATCH_TOKEN_BUDGET:
+                continue
+            if batch and (len(batch) == CLASSIFY_BATCH_SIZE or tokens + size > CLASSIFY_BATCH_TOKEN_BUDGET):
+                yield batch
+                batch, tokens = [], 0
+            batch.append(email)
+            tokens += size
+        if batch:
+            yield batch
+
+    def _classify_batch(self, emails):
+        """Classify several emails with one LLM call; returns {email id: label} for the ones it could parse."""
+        sections = [
+            f"Email {i}:\nSubject: {email['subject']}\nFrom: {email['sender']}\nBody: {email['body']}"
+            for i, email in enumerate(emails, 1)
+        ]
+        prompt = (
+            "Classify each of these emails as either 'spam/marketing' or 'important'.\n"
+            "Respond with only a JSON object mapping each email number to its label, "
+            'for example {"1": "important", "2": "spam/marketing"}.\n\n'
+            + "\n\n".join(sections)
+        )
+        response = self.llm.invoke([HumanMessage(content=prompt)])
+        content = response.content
+        start, end = content.find('{'), content.rfind('}')
+        try:
+            labels = json.loads(content[start:end + 1]) if start != -1 else {}
+        except ValueError:
+            labels = {}
+        if not isinstance(labels, dict):
+            labels = {}
+        classifications = {}
+        for i, email in enumerate(emails, 1):
+            label = str(labels.get(str(i), '')).strip().lower()
+            if label in LABELS:
+                classifications[email['id']] = label
+        return classifications
+
+    def _count(self, source, n=1):
+        with self._count_lock:
+            self.classified_by[source] += n
+
+    def classification_report(self):
+        """How the last run's emails were classified, and the share that skipped the LLM."""
+        total = sum(self.classified_by.values())
+        skipped = total - self.classified_by['llm']
+        return {
+            **{source: self.classified_by[source] for source in ('rules', 'cache', 'llm')},
+            'skipped_llm_fraction': round(skipped / total, 3) if total else 0.0
+        }
 
     def get_labels(self):
         """Get all Gmail labels."""
-        results = self.service.users().labels().list(userId='me').execute()
+        results = self.service.users().labels().list(userId='me').execute(http=self._http())
         labels = results.get('labels', [])
         return {label['name']: label['id'] for label in labels}
 
+    def label_id(self, name):
+        """Resolve a label name from the cached map, refreshing it when the name is missing."""
+        if name not in self._label_ids:
+            now = time.monotonic()
+            if self._labels_refreshed_at is None or now - self._labels_refreshed_at > LABEL_REFRESH_INTERVAL:
+                self._label_ids = self.get_labels()
+                self._labels_refreshed_at = now
+        return self._label_ids.get(name)
+
     def _build_graph(self) -> Graph:
         """Build the LangGraph for email processing."""
         
@@ -72,103 +318,100 @@ class EmailProcessor:
         def fetch_emails(state: EmailState) -> EmailState:
             """Fetch emails from INBOX."""
             print("DEBUG: Fetching emails from INBOX...")
-            results = self.service.users().messages().list(
-                userId='me',
-                labelIds=['INBOX'],
-                maxResults=1
-            ).execute()
-            messages = results.get('messages', [])
-            print(f"DEBUG: Found {len(messages)} messages")
+            message_ids, history_id = self._inbox_message_ids(state["sync"])
+            print(f"DEBUG: Found {len(message_ids)} messages")
             
-            emails = []
-            for message in messages:
-                msg = self.service.users().messages().get(
-                    userId='me', 
-                    id=message['id']
-                ).execute()
-                
-                headers = msg['payload']['headers']
-                subject = next((h['value'] for h in headers if h['name'] == 'Subject'), 'No Subject')
-                sender = next((h['value'] for h in headers if h['name'] == 'From'), 'Unknown Sender')
-                print('msg:', msg)
-                
-                # Get email body
-                if 'parts' in msg['payload']:
-                    body = msg['payload']['parts'][0]['body'].get('data', '')
-                else:
-                    body = msg['payload']['body'].get('data', '')
-                
-                if body:
-                    body = base64.urlsafe_b64decode(body).decode()
-            
-                
-                emails.append({
-                    'id': message['id'],
-                    'subject': subject,
-                    'sender': sender,                    
-                    'body'  : body
-                })
+            # One batch request per GMAIL_BATCH_SIZE messages instead of one get() each
+            emails = [self._email_from_message(msg) for msg in get_messages(self.service, message_ids, http=self._http())]
+            # Skip mail that left the inbox after it was added
+            emails = [email for email in emails if 'INBOX' in email['labels']]
             print(f"DEBUG: Processed {len(emails)} emails")
-            return {"emails": emails, "processed_emails": [], "current_email": None, "classification": None, "action_taken": False}
+            return {"emails": emails, "processed_emails": [], "current_email": None, "classification": None, "action_taken": False, "history_id": history_id, "classifications": {}}
+
+        def classify_batch(state: EmailState) -> EmailState:
+            """Classify the fetched emails up front: obvious ones by rules, then several per LLM call."""
+            classifications = {}
+            uncached = []
+            for email in state["emails"]:
+                label = self.pre_classifier.classify(email)
+                if label is not None:
+                    classifications[email['id']] = label
+                    self._count('rules')
+                    continue
+                cached = self.classification_cache.get(email)
+                if cached is None:
+                    uncached.append(email)
+                else:
+                    classifications[email['id']] = cached
+                    self._count('cache')
+            print(f"DEBUG: {len(state['emails']) - len(uncached)} of {len(state['emails'])} emails classified without the LLM")
+            # Small local models don't answer the batch prompt's JSON reliably
+            if CLASSIFY_BATCH_SIZE <= 1 or self.local_llm:
+                return {**state, "classifications": classifications}
+            for batch in self._classification_batches(uncached):
+                print(f"DEBUG: Classifying a batch of {len(batch)} emails")
+                try:
+                    labels = self._classify_batch(batch)
+                except Exception as e:
+                    print(f"DEBUG: Batch classification failed: {str(e)}")
+                    labels = {}
+                if len(labels) < len(batch):
+                    # classify_email falls back to one call each for these
+                    print(f"DEBUG: {len(batch) - len(labels)} emails left for per-email classification")
+                for email in batch:
+                    if email['id'] in labels:
+                        self.classification_cache.put(email, labels[email['id']])
+                self._count('llm', len(labels))
+                classifications.update(labels)
+            return {**state, "classifications": classifications}
 
         def classify_email(state: EmailState) -> EmailState:
             """Classify the current email."""
             print(f"DEBUG: Classifying email: {state['current_email']['subject']}")
             email = state["current_email"]
-            prompt = f"""
-            Analyze this email and classify it as either 'spam/marketing' or 'important':
-            
-            Subject: {email['subject']}
-            From: {email['sender']}
-            Body: {email['body']}
-            Respond with only 'spam/marketing' or 'important'.
-            """
+            # Rules and cache hits were resolved in classify_batch, which already looked up every email
+            classification = state["classifications"].get(email['id'])
+            if classification is not None:
+                return {**state, "classification": classification}
+
+            prompt = classification_prompt(email)
             
             response = self.llm.invoke([HumanMessage(content=prompt)])
-            classification = response.content.strip().lower()
+            classification = parse_label(response.content)
             print(f"DEBUG: Classification result: {classification}")
+            self._count('llm')
+            if classification is None:
+                # An unreadable answer leaves the email where it is, and uncached so it's retried
+                return {**state, "classification": 'important'}
+            self.classification_cache.put(email, classification)
             
             return {**state, "classification": classification}
 
-        # this does not work well yet classification is not good. need to improve it. TODO: improve it.
+        # tinyllama is often wrong; a bigger local model (OLLAMA_MODEL) classifies better
         def classify_email_ollama(state: EmailState) -> EmailState:
-            """Classify the current email using Ollama tinylama model."""
+            """Classify the current email on the local Ollama model (CLASSIFY_BACKEND=ollama)."""
             print(f"DEBUG: [Ollama] Classifying email: {state['current_email']['subject']}")
             email = state["current_email"]
-            prompt = f"""
-            Analyze this email and classify it as either 'spam/marketing' or 'important':
-            
-            Subject: {email['subject']}
-            From: {email['sender']}
-            Body: {email['body']}
-            Respond with only 'spam/marketing' or 'important'.
-            """
-            print(f"DEBUG: [Ollama] Prompt: {prompt}")
-            ollama_llm = ChatOllama(model="tinyllama")
-            response = ollama_llm.invoke([HumanMessage(content=prompt)])
-            classification = response.content.strip().lower()
-            print(f"DEBUG: [Ollama] Classification result: {classification}")
-            return {**state, "classification": classification}
+            # Rules and cache hits were resolved in classify_batch
+            classification = state["classifications"].get(email['id'])
+            if classification is not None:
+                return {**state, "classification": classification}
+            label = self.local_llm.classify(email)
+            print(f"DEBUG: [Ollama] Classification result: {label}")
+            self._count('llm')
+            if label is None:
+                # An unreadable answer leaves the email where it is, and uncached so it's retried
+                return {**state, "classification": 'important'}
+            self.classification_cache.put(email, label)
+            return {**state, "classification": label}
 
 
         def take_action(state: EmailState) -> EmailState:
             """Take action based on classification."""
             print(f"DEBUG: Taking action for email: {state['current_email']['subject']}")
             if state["classification"] == 'spam/marketing':
-                print("DEBUG: Moving email to spam")
-                # Move to spam
-                labels = self.get_labels()
-                spam_label_id = labels.get('spam-ai-bot')
-                
-                if spam_label_id:
-                    self.service.users().messages().modify(
-                        userId='me',
-                        id=state["current_email"]["id"],
-                        body={'addLabelIds': [spam_label_id], 'removeLabelIds': ['INBOX']}
-                    ).execute()
-                    print("DEBUG: Successfully moved email to spam")
-                else:
-                    print("DEBUG: Warning - spam label not found")
+                # Moved with the rest of the run's spam in apply_actions
+                print("DEBUG: Queued email for spam")
             
             processed = state["processed_emails"]
             processed.append({
@@ -180,6 +423,20 @@ class EmailProcessor:
             
             return {**state, "processed_emails": processed, "action_taken": True}
 
+        def apply_actions(state: EmailState) -> Dict:
+            """Move every email classified as spam in a handful of batchModify calls."""
+            spam_ids = [email['id'] for email in state["processed_emails"] if email['classification'] == 'spam/marketing']
+            if not spam_ids:
+                return {}
+            spam_label_id = self.label_id(SPAM_LABEL)
+            if spam_label_id:
+                modify_messages(self.service, spam_ids, add_label_ids=[spam_label_id], remove_label_ids=['INBOX'],
+                                http=self._http())
+                print(f"DEBUG: Successfully moved {len(spam_ids)} emails to spam")
+            else:
+                print("DEBUG: Warning - spam label not found")
+            return {}
+
         def should_continue(state: EmailState) -> Dict:
             """Determine if we should continue processing emails."""
             remaining = len(state["emails"])
@@ -198,19 +455,50 @@ class EmailProcessor:
             return {**state, "emails": emails, "current_email": current}
 
 
+        def process_email(state: EmailState) -> Dict:
+            """Classify and act on one email (parallel mode)."""
+            state = take_action(classify(state))
+            return {"processed_emails": state["processed_emails"]}
+
+        def fan_out(state: EmailState) -> List[Send]:
+            """Start one process_email task per fetched email."""
+            return [
+                Send("process_email", {**state, "emails": [], "current_email": email, "processed_emails": []})
+                for email in state["emails"]
+            ]
+
+        classify = classify_email_ollama if self.local_llm else classify_email
+
+        if PROCESS_CONCURRENCY > 1:
+            workflow = StateGraph(ParallelEmailState)
+            workflow.add_node("fetch_emails", fetch_emails)
+            workflow.add_node("classify_batch", classify_batch)
+            workflow.add_node("process_email", process_email)
+            workflow.add_node("apply_actions", apply_actions)
+            workflow.add_edge("fetch_emails", "classify_batch")
+            # Runs at most PROCESS_CONCURRENCY tasks at a time (max_concurrency in process_emails)
+            workflow.add_conditional_edges("classify_batch", fan_out, ["process_email"])
+            workflow.add_edge("process_email", "apply_actions")
+            workflow.add_edge("apply_actions", END)
+            workflow.set_entry_point("fetch_emails")
+            return workflow.compile()
+
         # Build the graph
         workflow = StateGraph(EmailState)
 
         # Add nodes
         workflow.add_node("fetch_emails", fetch_emails)
-        workflow.add_node("classify_email", classify_email)
-        # workflow.add_node("classify_email", classify_email_ollama)
+        workflow.add_node("classify_batch", classify_batch)
+        workflow.add_node("classify_email", classify)
         workflow.add_node("take_action", take_action)
         workflow.add_node("get_next_email", get_next_email)
         workflow.add_node("should_continue", should_continue)
+        workflow.add_node("apply_actions", apply_actions)
 
         # Add edges
-        workflow.add_edge("fetch_emails", "get_next_email")
+        workflow.add_edge("fetch_emails", "classify_batch")
+        # An empty inbox (common with incremental sync) ends the run straight away
+        workflow.add_edge("classify_batch", "should_continue")
         workflow.add_edge("get_next_email", "classify_email")
         workflow.add_edge("classify_email", "take_action")
         workflow.add_edge("take_action", "should_continue")
@@ -221,18 +509,23 @@ class EmailProcessor:
             lambda x: x["next"],  # Extract the "next" value from the dictionary
             {
                 "continue": "get_next_email",
-                "end": END
+                "end": "apply_actions"
             }
         )
 
+        workflow.add_edge("apply_actions", END)
+
         # Set entry point
         workflow.set_entry_point("fetch_emails")
 
         return workflow.compile()
 
-    def process_emails(self):
-        """Process emails using the LangGraph workflow."""
+    def process_emails(self, sync=None):
+        """Process emails using the LangGraph workflow; `sync` overrides INBOX_SYNC."""
+        sync = sync or INBOX_SYNC
         print("DEBUG: Starting email processing workflow...")
+        self._ensure_credentials()
+        self.classified_by.clear()
         
         # Initialize empty state
         initial_state = {
@@ -240,113 +533,68 @@ class EmailProcessor:
             "processed_emails": [],
             "current_email": None,
             "classification": None,
-            "action_taken": False
+            "action_taken": False,
+            "history_id": None,
+            "classifications": {},
+            "sync": sync
         }
         
         # Run the graph
-        result = self.graph.invoke(initial_state)
+        result = self.graph.invoke(
+            initial_state,
+            {"recursion_limit": GRAPH_RECURSION_LIMIT, "max_concurrency": PROCESS_CONCURRENCY}
+        )
         
+        # Only advance once every fetched email was handled, so a failed run is retried
+        if sync == "incremental" and result.get("history_id"):
+            save_sync_state({"historyId": result["history_id"]})
+        
+        self.classification_cache.evict()
+        cache = self.classification_cache
+        print(f"DEBUG: Classification cache: {cache.hits} hits, {cache.misses} misses")
+        print(f"DEBUG: Classified by: {self.classification_report()}")
         print(f"DEBUG: Workflow completed. Processed {len(result['processed_emails'])} emails")
         return result["processed_emails"]
 
     def find_subscription_emails(self, max_results=100):
         """Find emails that are likely subscriptions."""
         print("DEBUG: Searching for subscription emails...")
+        self._ensure_credentials()
         
         # Search for common subscription-related terms
         query = "category:promotions OR (unsubscribe OR subscription OR newsletter OR marketing)"
-        results = self.service.users().messages().list(
-            userId='me',
-            q=query,
-            maxResults=max_results
-        ).execute()
+        message_ids = list_message_ids(self.service, max_results, http=self._http(), q=query)
         
-        messages = results.get('messages', [])
         subscription_emails = []
-        
-        for message in messages:
-            msg = self.service.users().messages().get(
-                userId='me', 
-                id=message['id']
-            ).execute()
-            
-            headers = msg['payload']['headers']
-            subject = next((h['value'] for h in headers if h['name'] == 'Subject'), 'No Subject')
-            sender = next((h['value'] for h in headers if h['name'] == 'From'), 'Unknown Sender')
-            
-            # Get email body
-            if 'parts' in msg['payload']:
-                body = msg['payload']['parts'][0]['body'].get('data', '')
-            else:
-                body = msg['payload']['body'].get('data', '')
-            
-            if body:
-                body = base64.urlsafe_b64decode(body).decode()
+        for msg in get_messages(self.service, message_ids, http=self._http()):
+            email = self._email_from_message(msg)
             
-            # Extract unsubscribe links
-            unsubscribe_links = self._extract_unsubscribe_links(body)
+            # Extract unsubscribe links; the HTML is only decoded when the header has none
+            unsubscribe_links = (
+                self._extract_unsubscribe_links('', email['list_unsubscribe'])
+                or self._extract_unsubscribe_links(email.html or email['body'])
+            )
             
             subscription_emails.append({
-                'id': message['id'],
-                'subject': subject,
-                'sender': sender,
+                'id': email['id'],
+                'subject': email['subject'],
+                'sender': email['sender'],
+                'list_id': email['list_id'],
+                'list_unsubscribe': email['list_unsubscribe'],
+                'list_unsubscribe_post': email['list_unsubscribe_post'],
                 'unsubscribe_links': unsubscribe_links
             })
         
         return subscription_emails
 
-    def _extract_unsubscribe_links(self, html_content):
-        """Extract unsubscribe links from email content."""
-        soup = BeautifulSoup(html_content, 'html.parser')
-        unsubscribe_links = []
-        
-        # Look for common unsubscribe link patterns
-        patterns = [
-            'unsubscribe',
-            'opt-out',
-            'preferences',
-            'subscription',
-            'manage preferences',
-            'email preferences'
-        ]
-        
-        for link in soup.find_all('a'):
-            href = link.get('href', '')
-            text = link.get_text().lower()
-            
-            if any(pattern in text.lower() or pattern in href.lower() for pattern in patterns):
-                unsubscribe_links.append({
-                    'text': text,
-                    'url': href
-                })
-        
-        return unsubscribe_links
+    def watch_inbox(self, topic_name):
+        """Start or renew Gmail push notifications for INBOX on a Pub/Sub topic."""
+        self._ensure_credentials()
+        return watch_mailbox(self.service, topic_name, http=self._http())
 
-    def unsubscribe_from_email(self, email_data):
-        """Attempt to unsubscribe from an email subscription."""
-        print(f"DEBUG: Attempting to unsubscribe from: {email_data['sender']}")
-        
-        for link in email_data['unsubscribe_links']:
-            try:
-                # Validate URL
-                parsed_url = urlparse(link['url'])
-                if not parsed_url.scheme or not parsed_url.netloc:
-                    print(f"DEBUG: Invalid URL: {link['url']}")
-                    continue
-                
-                # Make the unsubscribe request
-                response = requests.get(link['url'], allow_redirects=True)
-                
-                if response.status_code == 200:
-                    print(f"DEBUG: Successfully unsubscribed from {email_data['sender']}")
-                    return True
-                else:
-                    print(f"DEBUG: Failed to unsubscribe. Status code: {response.status_code}")
-            
-            except Exception as e:
-                print(f"DEBUG: Error unsubscribing: {str(e)}")
-        
-        return False
+    def _extract_unsubscribe_links(self, html_content, list_unsubscribe=''):
+        """Extract unsubscribe links from the List-Unsubscribe header, or else the email content."""
+        return extract_unsubscribe_links(html_content, list_unsubscribe)
 
     def process_subscriptions(self):
         """Process and unsubscribe from email subscriptions."""
@@ -356,60 +604,74 @@ class EmailProcessor:
         subscription_emails = self.find_subscription_emails()
         print(f"DEBUG: Found {len(subscription_emails)} potential subscription emails")
         
-        results = []
-        for email in subscription_emails:
-            print(f"\nProcessing subscription from: {email['sender']}")
-            print(f"Subject: {email['subject']}")
-            
-            if email['unsubscribe_links']:
-                print("Found unsubscribe links:")
-                for link in email['unsubscribe_links']:
-                    print(f"- {link['text']}: {link['url']}")
-                
-                success = self.unsubscribe_from_email(email)
-                results.append({
-                    'sender': email['sender'],
-                    'subject': email['subject'],
-                    'unsubscribe_success': success
-                })
-            else:
-                print("No unsubscribe links found")
-                results.append({
-                    'sender': email['sender'],
-                    'subject': email['subject'],
-                    'unsubscribe_success': False,
-                    'reason': 'No unsubscribe links found'
-                })
-        
-        return results
+        # Each list is hit once, concurrently, with per-domain limits; see unsubscribe.py
+        report = asyncio.run(unsubscribe_all(subscription_emails))
+        print(f"DEBUG: Unsubscribed from {report['unsubscribed']} of {report['lists']} lists in {report['elapsed_s']}s")
+        return report
 
 @app.get("/")
 async def root():
     return {"message": "Email Assistant API is running"}
 
+# Plain def endpoints run in the threadpool, so a long run doesn't block the event loop
 @app.post("/process-emails")
-async def process_emails():
+def process_emails(sync: str = None):
+    sync = sync or INBOX_SYNC
+    if sync not in INBOX_SYNC_MODES:
+        raise HTTPException(status_code=400, detail=f"sync must be one of {', '.join(INBOX_SYNC_MODES)}")
     try:
-        print("DEBUG: Starting /process-emails endpoint")
-        processor = EmailProcessor()
-        results = processor.process_emails()
+        print(f"DEBUG: Starting /process-emails endpoint ({sync} sync)")
+        processor = app.state.processor
+        with processor.run_lock:
+            results = processor.process_emails(sync)
+            report = processor.classification_report()
         print(f"DEBUG: Successfully processed {len(results)} emails")
-        return {"status": "success", "results": results}
+        return {"status": "success", "sync": sync, "results": results, "classification": report}
     except Exception as e:
         print(f"DEBUG: Error in process_emails: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/process-subscriptions")
-async def process_subscriptions():
+def process_subscriptions():
     try:
         print("DEBUG: Starting /process-subscriptions endpoint")
-        processor = EmailProcessor()
-        results = processor.process_subscriptions()
-        print(f"DEBUG: Successfully processed {len(results)} subscriptions")
-        return {"status": "success", "results": results}
+        report = app.state.processor.process_subscriptions()
+        print(f"DEBUG: Successfully processed {report['lists']} subscriptions")
+        return {"status": "success", **report}
     except Exception as e:
         print(f"DEBUG: Error in process_subscriptions: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# Pub/Sub push endpoint; any 2xx acks the message, so it only records it and returns
+@app.post("/gmail/push", status_code=204)
+async def gmail_push(envelope: Dict, token: str = ""):
+    if PUBSUB_VERIFICATION_TOKEN and token != PUBSUB_VERIFICATION_TOKEN:
+        raise HTTPException(status_code=403, detail="Invalid token")
+    watcher = app.state.watcher
+    if not watcher:
+        print("DEBUG: Push notification ignored, WATCH_ENABLED is off")
+        return
+    # A malformed message would be redelivered forever if it failed, so it is
+    # logged and acked (2xx) without its historyId, and the run catches up anyway
+    try:
+        data = json.loads(base64.b64decode(envelope['message']['data']))
+    except (KeyError, TypeError, ValueError):
+        print(f"DEBUG: Malformed push notification: {envelope}")
+        data = {}
+    if not isinstance(data, dict):
+        print(f"DEBUG: Push notification data is not an object: {data!r}")
+        data = {}
+    history_id = data.get('historyId')
+    if history_id is not None and not str(history_id).isdigit():
+        print(f"DEBUG: Push notification with invalid historyId: {history_id!r}")
+        history_id = None
+    watcher.notify(history_id)
+
+@app.get("/watcher")
+async def watcher_status():
+    if not app.state.watcher:
+        raise HTTPException(status_code=404, detail="WATCH_ENABLED is off")
+    return app.state.watcher.status()
+
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
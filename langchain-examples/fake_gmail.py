@@ -0,0 +1,342 @@
+"""In-memory stand-in for the Gmail API, for local benchmarks.
+
+Run it with `uvicorn fake_gmail:app --port 9100` and point the email assistant
+at it with `GMAIL_API_ENDPOINT=http://localhost:9100/`. Every HTTP request,
+including a whole batch request, waits FAKE_GMAIL_LATENCY seconds to model the
+round trip to Google. The mailbox is seeded with FAKE_GMAIL_MESSAGES synthetic
+emails, a mix of newsletters and personal mail. `POST /fake/deliver?count=N`
+delivers new mail and records it in the mailbox history.
+
+It also stands in for Pub/Sub: after `users.watch()`, every delivered message
+is announced with a push request to FAKE_PUBSUB_PUSH_ENDPOINT, e.g.
+`http://localhost:8000/gmail/push`, in the envelope a push subscription uses.
+"""
+import asyncio
+import base64
+import json
+import os
+import re
+import time
+from email.parser import Parser
+from urllib.parse import parse_qs, urlparse
+
+import httpx
+from fastapi import FastAPI, Request, Response
+
+app = FastAPI()
+
+LATENCY = float(os.getenv("FAKE_GMAIL_LATENCY", "0.05"))
+# Extra server time per call inside a batch
+BATCH_ITEM_LATENCY = float(os.getenv("FAKE_GMAIL_BATCH_ITEM_LATENCY", "0.001"))
+MESSAGE_COUNT = int(os.getenv("FAKE_GMAIL_MESSAGES", "200"))
+# History records kept; older startHistoryIds get a 404 like an expired history
+HISTORY_LIMIT = int(os.getenv("FAKE_GMAIL_HISTORY_LIMIT", "10000"))
+PUSH_ENDPOINT = os.getenv("FAKE_PUBSUB_PUSH_ENDPOINT", "")
+
+stats = {"requests": 0, "batch_requests": 0, "calls": 0, "pushes": 0}
+
+labels = {
+    "INBOX": {"id": "INBOX", "name": "INBOX", "type": "system"},
+    "SPAM": {"id": "SPAM", "name": "SPAM", "type": "system"},
+    "CATEGORY_PROMOTIONS": {"id": "CATEGORY_PROMOTIONS", "name": "CATEGORY_PROMOTIONS", "type": "system"},
+    "Label_1": {"id": "Label_1", "name": "spam-ai-bot", "type": "user"},
+}
+messages = {}
+history = []
+mailbox = {"history_id": 0, "oldest_history_id": 0, "delivered": 0, "watch_topic": None}
+EMAIL_ADDRESS = "me@example.com"
+
+
+def _b64(text):
+    return base64.urlsafe_b64encode(text.encode()).decode()
+
+
+def _newsletter(i):
+    domain = f"news{i % 7}.example.com"
+    html = (
+        f"<html><body><h1>Weekly deals #{i}</h1>"
+        + "<p>Save big on everything this week. " * 40 + "</p>"
+        + f'<a href="https://{domain}/product/{i}">Shop now</a>'
+        + f'<p><a href="https://{domain}/unsubscribe?u={i}">Unsubscribe</a> | '
+        + f'<a href="https://{domain}/preferences?u={i}">Manage preferences</a></p>'
+        + "</body></html>"
+    )
+    return {
+        "labelIds": ["INBOX", "CATEGORY_PROMOTIONS"],
+        "payload": {
+            "mimeType": "multipart/alternative",
+            "headers": [
+                {"name": "From", "value": f"Deals <deals@{domain}>"},
+                {"name": "Subject", "value": f"Weekly deals #{i}"},
+                {"name": "List-Unsubscribe", "value": f"<https://{domain}/unsubscribe?u={i}>, <mailto:unsubscribe@{domain}>"},
+                {"name": "List-Unsubscribe-Post", "value": "List-Unsubscribe=One-Click"},
+            ],
+            "body": {"size": 0},
+            "parts": [
+                {"mimeType": "text/plain", "headers": [], "body": {"data": _b64(f"Weekly deals #{i}. Unsubscribe: https://{domain}/unsubscribe?u={i}")}},
+                {"mimeType": "text/html", "headers": [], "body": {"data": _b64(html)}},
+            ],
+        },
+    }
+
+
+def _personal(i):
+    return {
+        "labelIds": ["INBOX"],
+        "payload": {
+            "mimeType": "text/plain",
+            "headers": [
+                {"name": "From", "value": f"Friend {i} <friend{i}@example.org>"},
+                {"name": "Subject", "value": f"Lunch on day {i}?"},
+            ],
+            "body": {"data": _b64(f"Hi, are you free for lunch on day {i}? Let me know.")},
+        },
+    }
+
+
+def _next_history_id():
+    mailbox["history_id"] += 1
+    return str(mailbox["history_id"])
+
+
+def _record(**change):
+    history.append({"id": str(mailbox["history_id"]), **change})
+    if len(history) > HISTORY_LIMIT:
+        del history[0]
+        mailbox["oldest_history_id"] = int(history[0]["id"]) - 1
+
+
+def _stub(message):
+    return {"id": message["id"], "threadId": message["threadId"], "labelIds": list(message["labelIds"])}
+
+
+def _add_message(i, record=True):
+    message = _newsletter(i) if i % 2 == 0 else _personal(i)
+    message_id = f"{i + 1:016x}"
+    messages[message_id] = {"id": message_id, "threadId": message_id, "historyId": _next_history_id(), **message}
+    if record:
+        _record(messagesAdded=[{"message": _stub(messages[message_id])}])
+    return message_id
+
+
+def seed(count=MESSAGE_COUNT):
+    messages.clear()
+    history.clear()
+    mailbox.update(history_id=0, delivered=count)
+    for i in range(count):
+        _add_message(i, record=False)
+    # History starts now, as if older records had already expired
+    mailbox["oldest_history_id"] = mailbox["history_id"]
+
+
+def deliver(count):
+    ids = [_add_message(mailbox["delivered"] + i) for i in range(count)]
+    mailbox["delivered"] += count
+    return ids
+
+
+seed()
+
+
+def _headers(message, wanted):
+    wanted = {name.lower() for name in wanted}
+    return [h for h in message["payload"]["headers"] if not wanted or h["name"].lower() in wanted]
+
+
+def _list_messages(query):
+    found = list(messages.values())
+    for label in query.get("labelIds", []):
+        found = [m for m in found if label in m["labelIds"]]
+    if "q" in query:
+        # Crude stand-in for Gmail search: promotions or a List-Unsubscribe header
+        found = [m for m in found if "CATEGORY_PROMOTIONS" in m["labelIds"]]
+    limit = int(query.get("maxResults", ["100"])[0])
+    start = int(query.get("pageToken", ["0"])[0])
+    page = found[start:start + limit]
+    result = {
+        "messages": [{"id": m["id"], "threadId": m["threadId"]} for m in page],
+        "resultSizeEstimate": len(found),
+    }
+    if start + limit < len(found):
+        result["nextPageToken"] = str(start + limit)
+    return result
+
+
+def _get_message(message_id, query):
+    message = messages.get(message_id)
+    if message is None:
+        return 404, {"error": {"code": 404, "message": "Requested entity was not found."}}
+    form = query.get("format", ["full"])[0]
+    if form == "metadata":
+        payload = {"mimeType": message["payload"]["mimeType"],
+                   "headers": _headers(message, query.get("metadataHeaders", []))}
+        return 200, {**message, "payload": payload}
+    if form == "minimal":
+        return 200, {k: v for k, v in message.items() if k != "payload"}
+    return 200, message
+
+
+def _modify(message, add, remove):
+    removed = [label for label in remove if label in message["labelIds"]]
+    added = [label for label in add if label not in message["labelIds"]]
+    message["labelIds"] = [label for label in message["labelIds"] if label not in removed] + added
+    message["historyId"] = _next_history_id()
+    changes = {}
+    if added:
+        changes["labelsAdded"] = [{"message": _stub(message), "labelIds": added}]
+    if removed:
+        changes["labelsRemoved"] = [{"message": _stub(message), "labelIds": removed}]
+    if changes:
+        _record(**changes)
+
+
+_HISTORY_TYPES = {"messagesAdded": "messageAdded", "labelsAdded": "labelAdded", "labelsRemoved": "labelRemoved"}
+
+
+def _list_history(query):
+    start = int(query["startHistoryId"][0])
+    if start < mailbox["oldest_history_id"]:
+        return 404, {"error": {"code": 404, "message": "Requested entity was not found."}}
+    label = query.get("labelId", [None])[0]
+    types = query.get("historyTypes")
+    records = []
+    for record in history:
+        if int(record["id"]) <= start:
+            continue
+        record = {
+            key: value for key, value in record.items()
+            if key == "id" or not types or _HISTORY_TYPES[key] in types
+        }
+        if label:
+            record = {
+                key: [change for change in value if label in change["message"]["labelIds"] or label in change.get("labelIds", [])]
+                if key != "id" else value
+                for key, value in record.items()
+            }
+        if any(value for key, value in record.items() if key != "id"):
+            records.append(record)
+    limit = int(query.get("maxResults", ["100"])[0])
+    offset = int(query.get("pageToken", ["0"])[0])
+    result = {"history": records[offset:offset + limit], "historyId": str(mailbox["history_id"])}
+    if offset + limit < len(records):
+        result["nextPageToken"] = str(offset + limit)
+    return 200, result
+
+
+def handle(method, path, query, body):
+    """Serve one Gmail API call, returning (status, json)."""
+    stats["calls"] += 1
+    path = path.split("/gmail/v1/users/me/", 1)[-1]
+    if method == "GET" and path == "profile":
+        return 200, {"emailAddress": EMAIL_ADDRESS, "messagesTotal": len(messages),
+                     "historyId": str(mailbox["history_id"])}
+    if method == "GET" and path == "history":
+        return _list_history(query)
+    if method == "POST" and path == "watch":
+        mailbox["watch_topic"] = body["topicName"]
+        expiration = int((time.time() + 7 * 24 * 3600) * 1000)
+        return 200, {"historyId": str(mailbox["history_id"]), "expiration": str(expiration)}
+    if method == "POST" and path == "stop":
+        mailbox["watch_topic"] = None
+        return 200, {}
+    if method == "GET" and path == "labels":
+        return 200, {"labels": list(labels.values())}
+    if method == "GET" and path == "messages":
+        return 200, _list_messages(query)
+    if method == "POST" and path == "messages/batchModify":
+        if len(body.get("ids", [])) > 1000:
+            return 400, {"error": {"code": 400, "message": "Too many ids"}}
+        for message_id in body.get("ids", []):
+            if message_id in messages:
+                _modify(messages[message_id], body.get("addLabelIds", []), body.get("removeLabelIds", []))
+        return 200, {}
+    match = re.fullmatch(r"messages/([^/]+)", path)
+    if method == "GET" and match:
+        return _get_message(match.group(1), query)
+    match = re.fullmatch(r"messages/([^/]+)/modify", path)
+    if method == "POST" and match:
+        message = messages.get(match.group(1))
+        if message is None:
+            return 404, {"error": {"code": 404, "message": "Requested entity was not found."}}
+        _modify(message, body.get("addLabelIds", []), body.get("removeLabelIds", []))
+        return 200, {"id": message["id"], "labelIds": message["labelIds"]}
+    return 404, {"error": {"code": 404, "message": f"Unknown method {method} {path}"}}
+
+
+@app.api_route("/gmail/v1/users/me/{path:path}", methods=["GET", "POST"])
+async def gmail(path: str, request: Request):
+    await asyncio.sleep(LATENCY)
+    stats["requests"] += 1
+    raw = await request.body()
+    status, payload = handle(request.method, path, parse_qs(request.url.query), json.loads(raw) if raw else {})
+    return Response(json.dumps(payload), status_code=status, media_type="application/json")
+
+
+@app.post("/batch")
+@app.post("/batch/gmail/v1")
+async def batch(request: Request):
+    """Answer a multipart/mixed batch request the way googleapiclient expects."""
+    stats["requests"] += 1
+    stats["batch_requests"] += 1
+    content_type = request.headers["content-type"]
+    raw = (await request.body()).decode()
+    envelope = Parser().parsestr(f"Content-Type: {content_type}\r\n\r\n{raw}")
+    boundary = "batch_fake_gmail"
+    parts = []
+    for part in envelope.get_payload():
+        request_line, _, rest = part.get_payload().partition("\n")
+        method, target, _ = request_line.split(" ", 2)
+        body = rest.split("\n\n", 1)[1].strip() if "\n\n" in rest else ""
+        url = urlparse(target)
+        status, payload = handle(method, url.path, parse_qs(url.query), json.loads(body) if body else {})
+        parts.append(
+            f"--{boundary}\r\nContent-Type: application/http\r\n"
+            f"Content-ID: <response-{part['Content-ID'][1:-1]}>\r\n\r\n"
+            f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+            f"Content-Type: application/json; charset=UTF-8\r\n\r\n{json.dumps(payload)}\r\n"
+        )
+    await asyncio.sleep(LATENCY + BATCH_ITEM_LATENCY * len(parts))
+    return Response(
+        "".join(parts) + f"--{boundary}--\r\n",
+        media_type=f"multipart/mixed; boundary={boundary}"
+    )
+
+
+_publishing = set()
+
+
+async def publish(history_ids):
+    """Push one notification per change, concurrently, like a burst from Pub/Sub."""
+    async with httpx.AsyncClient(timeout=10) as client:
+        async def push(n, history_id):
+            data = json.dumps({"emailAddress": EMAIL_ADDRESS, "historyId": int(history_id)})
+            envelope = {
+                "message": {
+                    "data": base64.b64encode(data.encode()).decode(),
+                    "messageId": f"{history_id}-{n}",
+                    "publishTime": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                },
+                "subscription": "projects/fake/subscriptions/gmail-push",
+            }
+            try:
+                await client.post(PUSH_ENDPOINT, json=envelope)
+                stats["pushes"] += 1
+            except httpx.HTTPError as e:
+                print(f"Push to {PUSH_ENDPOINT} failed: {e!r}")
+        await asyncio.gather(*(push(n, history_id) for n, history_id in enumerate(history_ids)))
+
+
+@app.post("/fake/deliver")
+async def deliver_mail(count: int = 1):
+    ids = deliver(count)
+    if mailbox["watch_topic"] and PUSH_ENDPOINT:
+        # Sent after the response, as Pub/Sub would, a moment after the change
+        task = asyncio.create_task(publish([messages[i]["historyId"] for i in ids]))
+        _publishing.add(task)
+        task.add_done_callback(_publishing.discard)
+    return {"ids": ids, "historyId": str(mailbox["history_id"])}
+
+
+@app.get("/stats")
+async def get_stats():
+    return stats
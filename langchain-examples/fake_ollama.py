@@ -0,0 +1,120 @@
+"""Stand-in for a local Ollama server, for benchmarks without a GPU.
+
+Run it with `uvicorn fake_ollama:app --port 11434` and point the email
+assistant at it with `CLASSIFY_BACKEND=ollama OLLAMA_BASE_URL=http://localhost:11434`.
+It models what matters for throughput: loading the model on the first request
+(and again after keep_alive runs out), prompt processing time that grows with
+the prompt, per-token generation, and FAKE_OLLAMA_NUM_PARALLEL requests decoded
+at once with the rest queued. Replies are a keyword guess: a bare label,
+capitalized and with a period the way a small model answers.
+"""
+import asyncio
+import json
+import os
+import re
+import time
+from datetime import datetime, timezone
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+app = FastAPI()
+
+LOAD_TIME = float(os.getenv("FAKE_OLLAMA_LOAD_TIME", "2.0"))
+NUM_PARALLEL = int(os.getenv("FAKE_OLLAMA_NUM_PARALLEL", "4"))
+# Seconds per prompt token (~4 characters) and per generated token
+PROMPT_TOKEN_TIME = float(os.getenv("FAKE_OLLAMA_PROMPT_TOKEN_TIME", "0.0004"))
+TOKEN_TIME = float(os.getenv("FAKE_OLLAMA_TOKEN_TIME", "0.02"))
+
+_SPAM_WORDS = re.compile(r"unsubscribe|deals?\b|sale|offer|newsletter", re.IGNORECASE)
+
+stats = {"requests": 0, "loads": 0, "max_in_flight": 0, "prompt_chars": 0}
+model_state = {"loaded_until": 0.0, "loading": None}
+in_flight = 0
+slots = asyncio.Semaphore(NUM_PARALLEL)
+
+
+def _keep_alive_seconds(value):
+    if value is None:
+        return 300
+    if isinstance(value, (int, float)):
+        return float(value) if value >= 0 else float("inf")
+    units = {"s": 1, "m": 60, "h": 3600}
+    return float(value[:-1]) * units[value[-1]] if value[-1] in units else float(value)
+
+
+async def _ensure_loaded(keep_alive):
+    if time.monotonic() >= model_state["loaded_until"]:
+        # Concurrent first requests wait for the same load
+        if model_state["loading"] is None:
+            stats["loads"] += 1
+            model_state["loading"] = asyncio.ensure_future(asyncio.sleep(LOAD_TIME))
+        await model_state["loading"]
+        model_state["loading"] = None
+    model_state["loaded_until"] = time.monotonic() + _keep_alive_seconds(keep_alive)
+
+
+def _reply(prompt):
+    email = prompt.split("Subject:", 1)[-1]
+    if _SPAM_WORDS.search(email):
+        return "Spam/marketing."
+    return "Important."
+
+
+@app.get("/api/tags")
+async def tags():
+    return {"models": [{"name": "tinyllama:latest", "model": "tinyllama:latest"}]}
+
+
+@app.post("/api/chat")
+async def chat(request: Request):
+    global in_flight
+    body = await request.json()
+    if not body.get("messages"):
+        # Ollama's way to load (or, with keep_alive 0, unload) a model without generating
+        if _keep_alive_seconds(body.get("keep_alive")) == 0:
+            model_state["loaded_until"] = 0.0
+            reason = "unload"
+        else:
+            await _ensure_loaded(body.get("keep_alive"))
+            reason = "load"
+        return JSONResponse({"model": body.get("model"), "created_at": datetime.now(timezone.utc).isoformat(),
+                             "message": {"role": "assistant", "content": ""}, "done": True, "done_reason": reason})
+    prompt = "\n".join(m.get("content", "") for m in body.get("messages", []))
+    options = body.get("options") or {}
+    stats["requests"] += 1
+    stats["prompt_chars"] += len(prompt)
+    started = time.monotonic()
+    await _ensure_loaded(body.get("keep_alive"))
+    words = _reply(prompt).split(" ")
+    limit = options.get("num_predict") or 128
+    words = words[:limit] if limit > 0 else words
+    async with slots:
+        in_flight += 1
+        stats["max_in_flight"] = max(stats["max_in_flight"], in_flight)
+        try:
+            await asyncio.sleep(len(prompt) / 4 * PROMPT_TOKEN_TIME + len(words) * TOKEN_TIME)
+        finally:
+            in_flight -= 1
+    content = " ".join(words)
+    base = {"model": body.get("model", "tinyllama"), "created_at": datetime.now(timezone.utc).isoformat()}
+    final = {
+        **base, "done": True, "done_reason": "stop",
+        "total_duration": int((time.monotonic() - started) * 1e9),
+        "prompt_eval_count": len(prompt) // 4, "eval_count": len(words),
+    }
+    if body.get("stream", True) is False:
+        return JSONResponse({**final, "message": {"role": "assistant", "content": content}})
+
+    def lines():
+        for i, word in enumerate(words):
+            chunk = word if i == 0 else " " + word
+            yield json.dumps({**base, "message": {"role": "assistant", "content": chunk}, "done": False}) + "\n"
+        yield json.dumps({**final, "message": {"role": "assistant", "content": ""}}) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+@app.get("/stats")
+async def get_stats():
+    return stats
@@ -0,0 +1,205 @@
+"""Batched Gmail API helpers used by the email assistant."""
+import json
+import os
+import random
+import time
+
+from googleapiclient.errors import HttpError
+from googleapiclient.http import BatchHttpRequest
+
+# Point at a local stand-in (see fake_gmail.py) instead of Google
+GMAIL_API_ENDPOINT = os.getenv("GMAIL_API_ENDPOINT")
+# Gmail takes up to 100 calls per batch, but rate limits large batches sooner
+GMAIL_BATCH_SIZE = min(int(os.getenv("GMAIL_BATCH_SIZE", "50")), 100)
+GMAIL_MAX_RETRIES = 5
+BATCH_MODIFY_SIZE = 1000
+# Where the last synced historyId is kept between runs
+SYNC_STATE_FILE = os.getenv("SYNC_STATE_FILE", "sync_state.json")
+
+# Only what the assistant reads from a message; Gmail drops the rest server-side
+FULL_FIELDS = "id,threadId,labelIds,payload(mimeType,headers,body/data,parts)"
+METADATA_FIELDS = "id,threadId,labelIds,payload/headers"
+
+_RETRYABLE_STATUS = {429, 500, 502, 503}
+# Gmail reports per-user rate limits as 403 with one of these reasons
+_RATE_LIMIT_REASONS = {"rateLimitExceeded", "userRateLimitExceeded"}
+
+# Every helper takes the connection to use as `http`. The one built into the
+# service is a single httplib2.Http, which is not thread-safe, so callers on
+# several threads pass one connection per thread.
+
+
+def new_batch(service, callback=None):
+    if GMAIL_API_ENDPOINT:
+        # The discovery document hard-codes Google's batch URL
+        return BatchHttpRequest(callback=callback, batch_uri=GMAIL_API_ENDPOINT.rstrip("/") + "/batch")
+    return service.new_batch_http_request(callback=callback)
+
+
+def _backoff(attempt):
+    time.sleep(min(32, 2 ** attempt) * random.uniform(0.5, 1.5))
+
+
+def _error_reasons(error):
+    try:
+        body = json.loads(error.content)
+    except (TypeError, ValueError):
+        return set()
+    details = body.get('error', {}).get('errors', []) if isinstance(body, dict) else []
+    return {detail.get('reason') for detail in details if isinstance(detail, dict)}
+
+
+def _retryable(exception):
+    if not isinstance(exception, HttpError):
+        return False
+    status = exception.resp.status
+    return status in _RETRYABLE_STATUS or (status == 403 and bool(_error_reasons(exception) & _RATE_LIMIT_REASONS))
+
+
+def get_messages(service, message_ids, format="full", metadata_headers=None, fields=None, http=None):
+    """Fetch many messages with batch requests instead of one round trip each.
+
+    Returns the messages in the order of `message_ids`. Messages deleted since
+    they were listed are skipped. Calls that were rate limited inside a batch
+    (429, or 403 with a rate limit reason) or hit a 5xx are retried in a later
+    batch with jittered exponential backoff.
+    """
+    if fields is None:
+        fields = METADATA_FIELDS if format == "metadata" else FULL_FIELDS
+    found = {}
+    pending = list(dict.fromkeys(message_ids))
+    attempt = 0
+    while pending:
+        retry, errors = [], []
+
+        def callback(request_id, response, exception):
+            if exception is None:
+                found[request_id] = response
+            elif _retryable(exception):
+                retry.append(request_id)
+            elif not (isinstance(exception, HttpError) and exception.resp.status == 404):
+                errors.append(exception)
+
+        for start in range(0, len(pending), GMAIL_BATCH_SIZE):
+            batch = new_batch(service, callback)
+            for message_id in pending[start:start + GMAIL_BATCH_SIZE]:
+                batch.add(
+                    service.users().messages().get(
+                        userId='me',
+                        id=message_id,
+                        format=format,
+                        metadataHeaders=metadata_headers,
+                        fields=fields
+                    ),
+                    request_id=message_id
+                )
+            batch.execute(http=http)
+        if errors:
+            raise errors[0]
+        if retry:
+            if attempt >= GMAIL_MAX_RETRIES:
+                raise RuntimeError(f"Gmail kept rate limiting {len(retry)} message fetches")
+            _backoff(attempt)
+            attempt += 1
+        pending = retry
+    return [found[message_id] for message_id in message_ids if message_id in found]
+
+
+def list_message_ids(service, max_results, http=None, **query):
+    """List up to `max_results` message ids, following pages as needed."""
+    ids, page_token = [], None
+    while len(ids) < max_results:
+        results = service.users().messages().list(
+            userId='me',
+            maxResults=min(max_results - len(ids), 500),
+            pageToken=page_token,
+            fields="messages/id,nextPageToken",
+            **query
+        ).execute(http=http)
+        ids.extend(message['id'] for message in results.get('messages', []))
+        page_token = results.get('nextPageToken')
+        if not page_token:
+            break
+    return ids
+
+
+def modify_messages(service, message_ids, add_label_ids=(), remove_label_ids=(), http=None):
+    """Relabel messages with batchModify, which takes up to 1000 ids per call."""
+    for start in range(0, len(message_ids), BATCH_MODIFY_SIZE):
+        service.users().messages().batchModify(
+            userId='me',
+            body={
+                'ids': message_ids[start:start + BATCH_MODIFY_SIZE],
+                'addLabelIds': list(add_label_ids),
+                'removeLabelIds': list(remove_label_ids)
+            }
+        ).execute(http=http)
+
+
+def watch_mailbox(service, topic_name, label_id='INBOX', http=None):
+    """Ask Gmail to publish changes to `label_id` on a Pub/Sub topic; lasts 7 days.
+
+    Returns {'historyId', 'expiration'}. Calling it again renews the watch.
+    """
+    return service.users().watch(
+        userId='me',
+        body={'topicName': topic_name, 'labelIds': [label_id], 'labelFilterBehavior': 'include'}
+    ).execute(http=http)
+
+
+class HistoryExpired(Exception):
+    """The stored historyId is too old for history().list; a full sync is needed."""
+
+
+def get_history_id(service, http=None):
+    return service.users().getProfile(userId='me', fields="historyId").execute(http=http)['historyId']
+
+
+def list_history_message_ids(service, start_history_id, label_id='INBOX', http=None):
+    """Ids of messages added to `label_id` since `start_history_id`.
+
+    Returns (message_ids, latest_history_id). Raises HistoryExpired when Gmail
+    no longer has history that far back (it keeps roughly a week).
+    """
+    ids, page_token, latest = [], None, start_history_id
+    while True:
+        try:
+            results = service.users().history().list(
+                userId='me',
+                startHistoryId=start_history_id,
+                labelId=label_id,
+                historyTypes=['messageAdded', 'labelAdded'],
+                pageToken=page_token,
+                maxResults=500
+            ).execute(http=http)
+        except HttpError as e:
+            if e.resp.status == 404:
+                raise HistoryExpired(start_history_id)
+            raise
+        for record in results.get('history', []):
+            for added in record.get('messagesAdded', []):
+                if label_id in added['message'].get('labelIds', []):
+                    ids.append(added['message']['id'])
+            for added in record.get('labelsAdded', []):
+                if label_id in added.get('labelIds', []):
+                    ids.append(added['message']['id'])
+        latest = results.get('historyId', latest)
+        page_token = results.get('nextPageToken')
+        if not page_token:
+            return list(dict.fromkeys(ids)), latest
+
+
+def load_sync_state():
+    try:
+        with open(SYNC_STATE_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_sync_state(state):
+    # Write then rename so a crash never leaves a half-written file
+    tmp = SYNC_STATE_FILE + ".tmp"
+    with open(tmp, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp, SYNC_STATE_FILE)
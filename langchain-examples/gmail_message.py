@@ -0,0 +1,136 @@
+"""A compact, lazily decoded view of a Gmail message resource."""
+import base64
+import os
+import re
+from collections.abc import Mapping
+
+# Body bytes kept for the classifier prompt; longer bodies are cut
+EMAIL_BODY_MAX_BYTES = int(os.getenv("EMAIL_BODY_MAX_BYTES", "8192"))
+# HTML kept for link extraction; longer HTML keeps its start and its end, where the footer links are
+EMAIL_HTML_MAX_BYTES = int(os.getenv("EMAIL_HTML_MAX_BYTES", "131072"))
+
+_CHARSET = re.compile(r'charset="?([\w.:-]+)', re.IGNORECASE)
+
+
+def _cut(data, max_bytes, keep_end=False):
+    """Base64 segments that decode to at most `max_bytes`, so the rest is never decoded.
+
+    Every 4 base64 characters decode to 3 bytes on their own, so cuts on
+    4-character boundaries leave each segment decodable.
+    """
+    chars = max_bytes // 3 * 4
+    if len(data) <= chars:
+        return (data,)
+    if not keep_end:
+        return (data[:chars],)
+    half = chars // 8 * 4
+    tail_start = -(-(len(data) - half) // 4) * 4
+    return (data[:half], data[tail_start:])
+
+
+def _decode(segments, charset):
+    text = []
+    for data in segments:
+        raw = base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+        try:
+            # A multi-byte character cut at a segment edge is dropped rather than raising
+            text.append(raw.decode(charset, errors='ignore'))
+        except LookupError:
+            text.append(raw.decode('utf-8', errors='ignore'))
+    return '\n'.join(text)
+
+
+class GmailMessage(Mapping):
+    """Headers parsed once into a dict; text bodies found anywhere in the MIME tree.
+
+    Only the first text/plain and text/html parts are kept, still encoded and
+    already cut to the byte budgets, and each is decoded the first time it is
+    read. Memory per message is bounded by the budgets plus its headers.
+
+    Reads like the email dicts the graph used before: `message['subject']`,
+    `message.get('list_id')` and `{**message}` all work.
+    """
+
+    __slots__ = ('id', 'thread_id', 'labels', 'headers', '_encoded', '_decoded')
+
+    FIELDS = ('id', 'subject', 'sender', 'body', 'labels', 'list_unsubscribe', 'list_unsubscribe_post', 'list_id')
+
+    def __init__(self, resource):
+        self.id = resource['id']
+        self.thread_id = resource.get('threadId')
+        self.labels = resource.get('labelIds', [])
+        payload = resource.get('payload', {})
+        self.headers = {}
+        for header in payload.get('headers', []):
+            self.headers.setdefault(header['name'].lower(), header['value'])
+        # mime type -> (base64 segments, charset), cut to budget
+        self._encoded = {}
+        self._decoded = {}
+        self._walk(payload)
+
+    def _walk(self, payload):
+        budgets = {'text/plain': EMAIL_BODY_MAX_BYTES, 'text/html': EMAIL_HTML_MAX_BYTES}
+        stack = [payload]
+        while stack:
+            part = stack.pop()
+            children = part.get('parts')
+            if children:
+                # Reversed so the first child is visited first
+                stack.extend(reversed(children))
+                continue
+            mime_type = part.get('mimeType', '').lower()
+            data = part.get('body', {}).get('data')
+            if mime_type not in budgets or mime_type in self._encoded or not data or part.get('filename'):
+                continue
+            part_type = next((h['value'] for h in part.get('headers', []) if h['name'].lower() == 'content-type'), '')
+            charset = _CHARSET.search(part_type)
+            segments = _cut(data, budgets[mime_type], keep_end=mime_type == 'text/html')
+            self._encoded[mime_type] = (segments, charset.group(1) if charset else 'utf-8')
+
+    def _part(self, mime_type):
+        if mime_type not in self._decoded:
+            segments, charset = self._encoded.get(mime_type, ((), 'utf-8'))
+            self._decoded[mime_type] = _decode(segments, charset)
+        return self._decoded[mime_type]
+
+    def header(self, name, default=''):
+        return self.headers.get(name.lower(), default)
+
+    @property
+    def subject(self):
+        return self.header('subject', 'No Subject')
+
+    @property
+    def sender(self):
+        return self.header('from', 'Unknown Sender')
+
+    @property
+    def text(self):
+        return self._part('text/plain')
+
+    @property
+    def html(self):
+        return self._part('text/html')
+
+    @property
+    def body(self):
+        """The plain text body, or the HTML when there is none, within EMAIL_BODY_MAX_BYTES."""
+        if 'body' not in self._decoded:
+            if 'text/plain' in self._encoded:
+                self._decoded['body'] = self.text
+            else:
+                self._decoded['body'] = self.html.encode()[:EMAIL_BODY_MAX_BYTES].decode(errors='ignore')
+        return self._decoded['body']
+
+    def __getitem__(self, key):
+        if key in ('id', 'labels', 'subject', 'sender', 'body'):
+            return getattr(self, key)
+        if key in self.FIELDS:
+            return self.header(key.replace('_', '-'))
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(self.FIELDS)
+
+    def __len__(self):
+        return len(self.FIELDS)
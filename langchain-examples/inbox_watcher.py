@@ -0,0 +1,128 @@
+"""Continuous triage driven by Gmail push notifications.
+
+Gmail publishes a Pub/Sub message whenever the mailbox changes, and a push
+subscription delivers it to `POST /gmail/push`. The watcher collects those
+notifications, waits for a burst to settle, then runs one incremental
+`process_emails()` for everything that arrived. A slow poll covers any
+notification that gets lost.
+"""
+import asyncio
+import os
+import time
+
+from gmail_api import load_sync_state
+
+WATCH_ENABLED = os.getenv("WATCH_ENABLED", "false").lower() == "true"
+# Pub/Sub topic Gmail publishes to, e.g. projects/my-project/topics/gmail; empty skips users.watch()
+GMAIL_PUBSUB_TOPIC = os.getenv("GMAIL_PUBSUB_TOPIC", "")
+# Pub/Sub push subscriptions can carry it as ?token=... on the endpoint URL
+PUBSUB_VERIFICATION_TOKEN = os.getenv("PUBSUB_VERIFICATION_TOKEN", "")
+# Quiet time after the last notification before a run starts, and the longest a notification waits
+WATCH_DEBOUNCE = float(os.getenv("WATCH_DEBOUNCE", "2.0"))
+WATCH_MAX_DELAY = float(os.getenv("WATCH_MAX_DELAY", "10.0"))
+# Safety poll when no notification arrives; 0 turns it off
+WATCH_POLL_INTERVAL = float(os.getenv("WATCH_POLL_INTERVAL", "300"))
+# Gmail watches expire after 7 days; Google suggests renewing daily
+WATCH_RENEW_INTERVAL = 24 * 3600
+
+
+class InboxWatcher:
+    def __init__(self, processor):
+        self.processor = processor
+        self._wake = asyncio.Event()
+        self._first_event_at = None
+        self._tasks = []
+        self.notifications = 0
+        self.skipped = 0
+        self.runs = 0
+        self.last_run = None
+
+    async def start(self):
+        self._tasks = [asyncio.create_task(self._run())]
+        if GMAIL_PUBSUB_TOPIC:
+            self._tasks.append(asyncio.create_task(self._renew_watch()))
+        else:
+            print("DEBUG: GMAIL_PUBSUB_TOPIC not set, relying on an existing watch and polling")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def notify(self, history_id=None):
+        """Record a push notification; the run starts once the burst settles."""
+        self.notifications += 1
+        stored = load_sync_state().get('historyId')
+        if history_id and stored and int(history_id) <= int(stored):
+            # Already covered by the last run
+            self.skipped += 1
+            return
+        if self._first_event_at is None:
+            self._first_event_at = time.monotonic()
+        self._wake.set()
+
+    async def _renew_watch(self):
+        while True:
+            try:
+                response = await asyncio.to_thread(self.processor.watch_inbox, GMAIL_PUBSUB_TOPIC)
+                print(f"DEBUG: Gmail watch on {GMAIL_PUBSUB_TOPIC} until {response.get('expiration')}")
+                await asyncio.sleep(WATCH_RENEW_INTERVAL)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"DEBUG: Gmail watch failed, retrying in a minute: {str(e)}")
+                await asyncio.sleep(60)
+
+    async def _settle(self):
+        """Wait until no notification arrived for WATCH_DEBOUNCE, or WATCH_MAX_DELAY has passed."""
+        while True:
+            self._wake.clear()
+            first = self._first_event_at or time.monotonic()
+            remaining = min(WATCH_DEBOUNCE, first + WATCH_MAX_DELAY - time.monotonic())
+            if remaining <= 0:
+                return
+            try:
+                await asyncio.wait_for(self._wake.wait(), remaining)
+            except asyncio.TimeoutError:
+                return
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), WATCH_POLL_INTERVAL or None)
+            except asyncio.TimeoutError:
+                pass
+            await self._settle()
+            first, self._first_event_at = self._first_event_at, None
+            started = time.monotonic()
+            try:
+                results = await asyncio.to_thread(self._process)
+                error = None
+            except Exception as e:
+                results, error = [], str(e)
+                print(f"DEBUG: Watcher run failed: {error}")
+            self.runs += 1
+            self.last_run = {
+                'at': time.time(),
+                'processed': len(results),
+                'duration_s': round(time.monotonic() - started, 3),
+                # From the first notification of the burst to the end of the run
+                'latency_s': round(time.monotonic() - first, 3) if first else None,
+                'error': error
+            }
+
+    def _process(self):
+        with self.processor.run_lock:
+            # Notifications only make sense against the stored historyId,
+            # whatever INBOX_SYNC says for /process-emails
+            return self.processor.process_emails(sync="incremental")
+
+    def status(self):
+        return {
+            'notifications': self.notifications,
+            'skipped': self.skipped,
+            'runs': self.runs,
+            'pending': self._first_event_at is not None,
+            'last_run': self.last_run
+        }
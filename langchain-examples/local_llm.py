@@ -0,0 +1,97 @@
+"""Email classification on a local Ollama model.
+
+One `ChatOllama` is shared by every thread, so requests reuse its pooled
+HTTP connections. At most OLLAMA_CONCURRENCY requests are in flight; set
+OLLAMA_NUM_PARALLEL on the Ollama server to the same number so they are
+decoded together rather than queued there. Bodies are cut before they reach
+the prompt, since a small model's context window is a few thousand tokens.
+"""
+import os
+import threading
+import time
+
+from langchain_core.messages import HumanMessage
+from langchain_ollama import ChatOllama
+
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "tinyllama")
+OLLAMA_CONCURRENCY = int(os.getenv("OLLAMA_CONCURRENCY", "4"))
+OLLAMA_TIMEOUT = float(os.getenv("OLLAMA_TIMEOUT", "60"))
+# How long Ollama keeps the model loaded after the last request
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+# Body characters kept in the prompt; ~4 characters per token
+OLLAMA_MAX_BODY_CHARS = int(os.getenv("OLLAMA_MAX_BODY_CHARS", "2000"))
+OLLAMA_NUM_CTX = int(os.getenv("OLLAMA_NUM_CTX", "2048"))
+# A label is a handful of tokens; don't let the model ramble
+OLLAMA_NUM_PREDICT = 8
+
+_MAX_SUBJECT_CHARS = 200
+
+
+def classification_prompt(email, max_body_chars=None):
+    """The single-email prompt, with subject and body cut when `max_body_chars` is given."""
+    subject, body = email['subject'], email['body']
+    if max_body_chars is not None:
+        subject, body = subject[:_MAX_SUBJECT_CHARS], body[:max_body_chars]
+    return f"""
+            Analyze this email and classify it as either 'spam/marketing' or 'important':
+            
+            Subject: {subject}
+            From: {email['sender']}
+            Body: {body}
+            Respond with only 'spam/marketing' or 'important'.
+            """
+
+
+# Replies that count as a label once case, quotes and punctuation are stripped
+_LABEL_REPLIES = {
+    'spam/marketing': 'spam/marketing',
+    'spam': 'spam/marketing',
+    'marketing': 'spam/marketing',
+    'important': 'important',
+}
+
+
+def parse_label(text):
+    """Return 'spam/marketing' or 'important' when the reply is exactly that label, else None.
+
+    Searching a longer reply for keywords gets "not spam" wrong, and the label
+    is cached and acted on, so anything but a bare label counts as unreadable.
+    """
+    return _LABEL_REPLIES.get(text.strip().strip('\'"`*.!').strip().lower())
+
+
+class LocalClassifier:
+    def __init__(self, model=OLLAMA_MODEL, base_url=OLLAMA_BASE_URL, concurrency=OLLAMA_CONCURRENCY):
+        self.llm = ChatOllama(
+            model=model,
+            base_url=base_url,
+            temperature=0,
+            num_ctx=OLLAMA_NUM_CTX,
+            num_predict=OLLAMA_NUM_PREDICT,
+            keep_alive=OLLAMA_KEEP_ALIVE,
+            client_kwargs={'timeout': OLLAMA_TIMEOUT},
+        )
+        self._slots = threading.BoundedSemaphore(concurrency)
+
+    @property
+    def model_name(self):
+        return self.llm.model
+
+    def warm_up(self):
+        """Load the model into memory now rather than on the first email; returns seconds taken."""
+        started = time.perf_counter()
+        try:
+            self.llm.invoke([HumanMessage(content="Reply with OK.")], stream=False)
+        except Exception as e:
+            print(f"DEBUG: [Ollama] Warm-up failed: {str(e)}")
+        return time.perf_counter() - started
+
+    def complete(self, prompt):
+        with self._slots:
+            # One response instead of a stream of token chunks
+            return self.llm.invoke([HumanMessage(content=prompt)], stream=False).content
+
+    def classify(self, email):
+        """Return 'spam/marketing' or 'important', or None when the reply names neither."""
+        return parse_label(self.complete(classification_prompt(email, OLLAMA_MAX_BODY_CHARS)))
@@ -0,0 +1,126 @@
+"""Cheap local classification for emails that obviously are, or aren't, marketing.
+
+Signals are added up as log-odds of 'spam/marketing': Gmail's promotions
+label, List-Unsubscribe headers, a sender-domain reputation table and,
+when one has been trained, a linear model over hashed tokens. Only emails
+whose probability clears one of the thresholds are labeled here; the rest
+go to the LLM.
+
+Train the token model from labeled emails, one JSON object per line with
+subject, sender, body and label:
+
+    python pre_classifier.py train labeled.jsonl
+"""
+import json
+import math
+import os
+import re
+import sys
+import zlib
+
+PRE_CLASSIFIER_ENABLED = os.getenv("PRE_CLASSIFIER_ENABLED", "true").lower() == "true"
+# Probability of spam/marketing needed to skip the LLM either way
+PRE_CLASSIFY_SPAM_THRESHOLD = float(os.getenv("PRE_CLASSIFY_SPAM_THRESHOLD", "0.95"))
+PRE_CLASSIFY_IMPORTANT_THRESHOLD = float(os.getenv("PRE_CLASSIFY_IMPORTANT_THRESHOLD", "0.05"))
+# {"domain": "marketing" | "trusted"}; subdomains match their parent
+SENDER_REPUTATION_FILE = os.getenv("SENDER_REPUTATION_FILE", "sender_reputation.json")
+PRE_CLASSIFIER_MODEL_FILE = os.getenv("PRE_CLASSIFIER_MODEL_FILE", "pre_classifier_model.json")
+
+# Log-odds each signal adds
+PROMOTIONS_WEIGHT = 2.5
+LIST_UNSUBSCRIBE_WEIGHT = 2.0
+ONE_CLICK_WEIGHT = 0.5
+REPUTATION_WEIGHTS = {"marketing": 3.0, "trusted": -4.0}
+
+_FEATURES = 2 ** 18
+# Only the start of the body; enough for a newsletter's wording
+_MAX_BODY_CHARS = 4000
+_TOKEN = re.compile(r"[a-z0-9]{2,20}")
+_SENDER_DOMAIN = re.compile(r"@([\w.-]+)")
+
+
+def _load_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def sender_domain(sender):
+    match = _SENDER_DOMAIN.search(sender)
+    return match.group(1).lower().rstrip('>') if match else ''
+
+
+def _features(email):
+    """Hashed token ids; the sender domain is its own token."""
+    text = f"{email['subject']} {email['body'][:_MAX_BODY_CHARS]}".lower()
+    tokens = set(_TOKEN.findall(text))
+    tokens.add("@" + sender_domain(email['sender']))
+    return {zlib.crc32(token.encode()) % _FEATURES for token in tokens}
+
+
+class PreClassifier:
+    def __init__(self, reputation=None, model=None):
+        self.reputation = reputation if reputation is not None else _load_json(SENDER_REPUTATION_FILE) or {}
+        model = model if model is not None else _load_json(PRE_CLASSIFIER_MODEL_FILE)
+        self.bias = model["bias"] if model else 0.0
+        self.weights = {int(k): v for k, v in model["weights"].items()} if model else {}
+
+    def _reputation(self, domain):
+        parts = domain.split('.')
+        for i in range(len(parts) - 1):
+            verdict = self.reputation.get('.'.join(parts[i:]))
+            if verdict:
+                return REPUTATION_WEIGHTS.get(verdict, 0.0)
+        return 0.0
+
+    def spam_probability(self, email):
+        score = 0.0
+        if 'CATEGORY_PROMOTIONS' in email.get('labels', []):
+            score += PROMOTIONS_WEIGHT
+        if email.get('list_unsubscribe'):
+            score += LIST_UNSUBSCRIBE_WEIGHT
+        if email.get('list_unsubscribe_post'):
+            score += ONE_CLICK_WEIGHT
+        score += self._reputation(sender_domain(email['sender']))
+        if self.weights:
+            score += self.bias + sum(self.weights.get(f, 0.0) for f in _features(email))
+        return 1 / (1 + math.exp(-max(-30.0, min(30.0, score))))
+
+    def classify(self, email):
+        """Return 'spam/marketing' or 'important' when confident, otherwise None."""
+        if not PRE_CLASSIFIER_ENABLED:
+            return None
+        p = self.spam_probability(email)
+        if p >= PRE_CLASSIFY_SPAM_THRESHOLD:
+            return 'spam/marketing'
+        if p <= PRE_CLASSIFY_IMPORTANT_THRESHOLD:
+            return 'important'
+        return None
+
+
+def train(examples, epochs=5, learning_rate=0.1, l2=1e-4):
+    """Fit a logistic regression over hashed tokens with plain SGD."""
+    data = [(_features(e), 1.0 if e['label'] == 'spam/marketing' else 0.0) for e in examples]
+    weights, bias = {}, 0.0
+    for _ in range(epochs):
+        for features, y in data:
+            z = bias + sum(weights.get(f, 0.0) for f in features)
+            error = 1 / (1 + math.exp(-max(-30.0, min(30.0, z)))) - y
+            bias -= learning_rate * error
+            for f in features:
+                w = weights.get(f, 0.0)
+                weights[f] = w - learning_rate * (error + l2 * w)
+    return {"bias": bias, "weights": {str(f): round(w, 4) for f, w in weights.items() if abs(w) > 1e-3}}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3 or sys.argv[1] != "train":
+        sys.exit(__doc__)
+    with open(sys.argv[2]) as f:
+        examples = [json.loads(line) for line in f if line.strip()]
+    model = train(examples)
+    with open(PRE_CLASSIFIER_MODEL_FILE, 'w') as f:
+        json.dump(model, f)
+    print(f"Trained on {len(examples)} emails, {len(model['weights'])} weights -> {PRE_CLASSIFIER_MODEL_FILE}")
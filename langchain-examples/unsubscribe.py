@@ -0,0 +1,199 @@
+"""Concurrent unsubscribe requests with per-domain politeness."""
+import asyncio
+import html
+import json
+import os
+import re
+import time
+from collections import OrderedDict
+from datetime import datetime
+from urllib.parse import urlparse
+
+import httpx
+
+UNSUBSCRIBE_CONCURRENCY = int(os.getenv("UNSUBSCRIBE_CONCURRENCY", "20"))
+# Requests in flight per sender domain, and the gap between starting two of them
+UNSUBSCRIBE_PER_DOMAIN = int(os.getenv("UNSUBSCRIBE_PER_DOMAIN", "2"))
+UNSUBSCRIBE_DOMAIN_DELAY = float(os.getenv("UNSUBSCRIBE_DOMAIN_DELAY", "1.0"))
+# Per request, covering connect, redirects and a server that trickles its reply
+UNSUBSCRIBE_TIMEOUT = float(os.getenv("UNSUBSCRIBE_TIMEOUT", "10"))
+# Links tried per list before giving up
+UNSUBSCRIBE_MAX_ATTEMPTS = int(os.getenv("UNSUBSCRIBE_MAX_ATTEMPTS", "3"))
+UNSUBSCRIBE_REPORT_FILE = os.getenv("UNSUBSCRIBE_REPORT_FILE", "unsubscribe_report.json")
+
+_HEADER_URL = re.compile(r"<\s*([^>\s]+)\s*>")
+_ADDRESS = re.compile(r"[\w.+-]+@[\w.-]+")
+
+# Words that mark an unsubscribe link, in its text or its URL
+LINK_PATTERNS = ('unsubscribe', 'opt-out', 'preferences', 'subscription', 'manage preferences', 'email preferences')
+# The longer patterns contain 'preferences'; substring tests beat a case-insensitive regex here
+_LINK_KEYWORDS = ('unsubscribe', 'opt-out', 'preferences', 'subscription')
+_ANCHOR = re.compile(r"<a\b([^>]*)>(.*?)</a\s*>", re.IGNORECASE | re.DOTALL)
+_HREF = re.compile(r"""\bhref\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+))""", re.IGNORECASE)
+_TAG = re.compile(r"<[^>]*>")
+
+
+def header_urls(value):
+    """URLs in a List-Unsubscribe header: `<https://...>, <mailto:...>`."""
+    return _HEADER_URL.findall(value or '')
+
+
+def _has_keyword(text):
+    return any(keyword in text for keyword in _LINK_KEYWORDS)
+
+
+def extract_unsubscribe_links(body, list_unsubscribe=''):
+    """Unsubscribe links as [{'text', 'url'}], without building an HTML tree.
+
+    Web URLs from the List-Unsubscribe header are used when there are any;
+    the body is only scanned otherwise, in one regex pass over the anchors.
+    Keywords are matched in each anchor's text with tags stripped and entities
+    decoded, so `Un<b>subscribe</b>` is found; the raw body is not prefiltered
+    since the keyword may not appear in it as written.
+    """
+    urls = [url for url in header_urls(list_unsubscribe) if _is_web_url(url)]
+    if urls:
+        return [{'text': 'list-unsubscribe header', 'url': url} for url in urls]
+    if not body:
+        return []
+    links = []
+    for attributes, inner in _ANCHOR.findall(body):
+        href = _HREF.search(attributes)
+        href = html.unescape(next(filter(None, href.groups()), '')) if href else ''
+        text = html.unescape(_TAG.sub('', inner)).lower()
+        if _has_keyword(text) or _has_keyword(href.lower()):
+            links.append({'text': text, 'url': href})
+    return links
+
+
+def list_key(email):
+    """Emails from the same mailing list share a key, so each list is unsubscribed once."""
+    if email.get('list_id'):
+        return email['list_id'].strip().lower()
+    match = _ADDRESS.search(email['sender'])
+    return match.group(0).lower() if match else email['sender']
+
+
+def _is_web_url(url):
+    parsed = urlparse(url)
+    return parsed.scheme in ('http', 'https') and bool(parsed.netloc)
+
+
+def plan(email):
+    """(method, url) attempts for one email, best first.
+
+    An https List-Unsubscribe URL with `List-Unsubscribe-Post: List-Unsubscribe=One-Click`
+    gets the RFC 8058 one-click POST; other header URLs and links found in
+    the body are fetched with GET. mailto: addresses are not handled.
+    """
+    attempts = []
+    one_click = 'one-click' in email.get('list_unsubscribe_post', '').lower()
+    for url in header_urls(email.get('list_unsubscribe')):
+        if not _is_web_url(url):
+            continue
+        if one_click and url.startswith('https://'):
+            attempts.append(('one-click', url))
+        attempts.append(('get', url))
+    for link in email.get('unsubscribe_links', []):
+        if _is_web_url(link['url']):
+            attempts.append(('get', link['url']))
+    return list(dict.fromkeys(attempts))
+
+
+class Unsubscriber:
+    """Runs unsubscribe requests on one pooled client.
+
+    At most `concurrency` requests run at once, at most `per_domain` per
+    host, and requests to one host start `domain_delay` seconds apart.
+    """
+
+    def __init__(self, client, concurrency=UNSUBSCRIBE_CONCURRENCY, per_domain=UNSUBSCRIBE_PER_DOMAIN,
+                 domain_delay=UNSUBSCRIBE_DOMAIN_DELAY):
+        self.client = client
+        self.per_domain = per_domain
+        self.domain_delay = domain_delay
+        self._slots = asyncio.Semaphore(concurrency)
+        self._domains = {}
+        self._next_start = {}
+
+    async def _request(self, method, url):
+        domain = urlparse(url).hostname
+        domain_slots = self._domains.setdefault(domain, asyncio.Semaphore(self.per_domain))
+        async with domain_slots:
+            now = time.monotonic()
+            start = max(now, self._next_start.get(domain, now))
+            self._next_start[domain] = start + self.domain_delay
+            await asyncio.sleep(start - now)
+            async with self._slots:
+                if method == 'one-click':
+                    # RFC 8058: no redirects, and the body is exactly this form field
+                    request = self.client.post(url, data={'List-Unsubscribe': 'One-Click'})
+                else:
+                    request = self.client.get(url, follow_redirects=True)
+                # httpx timeouts apply per read, so also bound the request as a whole
+                return await asyncio.wait_for(request, UNSUBSCRIBE_TIMEOUT)
+
+    async def unsubscribe(self, emails):
+        """Unsubscribe from the list the given emails came from; returns one report entry."""
+        first = emails[0]
+        result = {
+            'sender': first['sender'],
+            'subject': first['subject'],
+            'list': list_key(first),
+            'emails': len(emails),
+            'unsubscribe_success': False,
+            'attempts': []
+        }
+        attempts = list(dict.fromkeys(attempt for email in emails for attempt in plan(email)))
+        if not attempts:
+            result['reason'] = 'No unsubscribe links found'
+            return result
+        for method, url in attempts[:UNSUBSCRIBE_MAX_ATTEMPTS]:
+            started = time.perf_counter()
+            attempt = {'method': method, 'url': url}
+            try:
+                response = await self._request(method, url)
+                attempt['status'] = response.status_code
+                success = response.is_success if method == 'one-click' else response.status_code < 400
+            except (httpx.HTTPError, asyncio.TimeoutError) as e:
+                attempt['error'] = f"{type(e).__name__}: {e}" if str(e) else type(e).__name__
+                success = False
+            attempt['elapsed_ms'] = round((time.perf_counter() - started) * 1000)
+            result['attempts'].append(attempt)
+            if success:
+                print(f"DEBUG: Unsubscribed from {result['list']} ({method} {url})")
+                result.update(unsubscribe_success=True, method=method, url=url)
+                return result
+        last = result['attempts'][-1]
+        result['reason'] = last.get('error') or f"HTTP {last['status']}"
+        print(f"DEBUG: Failed to unsubscribe from {result['list']}: {result['reason']}")
+        return result
+
+
+async def unsubscribe_all(emails, report_file=UNSUBSCRIBE_REPORT_FILE, transport=None):
+    """Unsubscribe from every list among `emails` and write a JSON report."""
+    lists = OrderedDict()
+    for email in emails:
+        lists.setdefault(list_key(email), []).append(email)
+    started = time.perf_counter()
+    async with httpx.AsyncClient(
+        timeout=UNSUBSCRIBE_TIMEOUT,
+        limits=httpx.Limits(max_connections=UNSUBSCRIBE_CONCURRENCY),
+        headers={'User-Agent': 'email-assistant-unsubscribe'},
+        transport=transport
+    ) as client:
+        unsubscriber = Unsubscriber(client)
+        results = await asyncio.gather(*(unsubscriber.unsubscribe(group) for group in lists.values()))
+    report = {
+        'generated_at': datetime.now().isoformat(timespec='seconds'),
+        'elapsed_s': round(time.perf_counter() - started, 2),
+        'emails': len(emails),
+        'lists': len(results),
+        'unsubscribed': sum(r['unsubscribe_success'] for r in results),
+        'no_links': sum(1 for r in results if not r['attempts']),
+        'results': results
+    }
+    if report_file:
+        with open(report_file, 'w') as f:
+            json.dump(report, f, indent=2)
+    return report